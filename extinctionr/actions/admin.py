@@ -1,11 +1,21 @@
+from io import TextIOWrapper
+
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
 from django.db import models
 from django import forms
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import path
 from .models import Action, ActionRole, Attendee, TalkProposal
+from .importer import read_signups
 from markdownx.admin import MarkdownxModelAdmin
 from contacts.models import Contact
 
 
+class SignupUploadForm(forms.Form):
+    csv = forms.FileField(label='Sign-in sheet (CSV)')
+
+
 @admin.register(Action)
 class ActionAdmin(MarkdownxModelAdmin):
     list_display = ('slug', 'name', 'when')
@@ -16,6 +26,37 @@ class ActionAdmin(MarkdownxModelAdmin):
     #     models.DateTimeField: {'widget': forms.DateTimeInput},
     # }
 
+    def get_urls(self):
+        urls = [
+            path('<int:object_id>/signups/', self.admin_site.admin_view(self.upload_signups), name='actions_action_signups'),
+        ]
+        return urls + super().get_urls()
+
+    def upload_signups(self, request, object_id):
+        action = get_object_or_404(Action, pk=object_id)
+        if not self.has_change_permission(request, action):
+            raise PermissionDenied
+        if request.method == 'POST':
+            form = SignupUploadForm(request.POST, request.FILES)
+            if form.is_valid():
+                f = TextIOWrapper(request.FILES['csv'].file, encoding=request.encoding or 'utf-8')
+                try:
+                    num = action.bulk_signup(read_signups(f))
+                except ValueError:
+                    form.add_error('csv', 'The CSV file needs an email column')
+                else:
+                    self.message_user(request, 'Added %d attendees to %s' % (num, action))
+                    return redirect('admin:actions_action_change', action.pk)
+        else:
+            form = SignupUploadForm()
+        ctx = dict(
+            self.admin_site.each_context(request),
+            title='Upload sign-in sheet',
+            opts=self.model._meta,
+            original=action,
+            form=form)
+        return render(request, 'admin/actions/action/signup_upload.html', ctx)
+
 
 @admin.register(Attendee)
 class AttendeeAdmin(admin.ModelAdmin):
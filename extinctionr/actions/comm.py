@@ -1,7 +1,10 @@
 from django.conf import settings
-from django.core.mail import send_mass_mail
+from django.db import transaction
+from django.db.models import Value
+from django.db.models.functions import Coalesce
 from django.utils.timezone import now, localtime
 from django.utils import dateformat
+from extinctionr.info.mail import queue_mass_mail
 
 from .models import Action, Attendee
 
@@ -21,6 +24,60 @@ P.S. If you can't make it, please get in touch. We're all in this together.
 '''
 
 
+# the attendee columns needed to render and record a notification
+ATTENDEE_FIELDS = ('id', 'promised', 'mutual_commitment', 'contact__first_name', 'contact__last_name', 'contact__email')
+
+
+def render_messages(action, attendees, action_url):
+    """
+    Returns the notification emails for `attendees`, which are rows of a values() projection on ATTENDEE_FIELDS
+    """
+    subject = "[XR] We've got enough to commit to %s" % action.name
+    from_email = settings.DEFAULT_FROM_EMAIL
+    when = dateformat.format(localtime(action.when), 'l, F jS @ g:iA')
+    messages = []
+    for row in attendees:
+        msg = MESSAGE.format(
+            name='%s %s' % (row['contact__first_name'], row['contact__last_name']),
+            action_name=action.name,
+            action_date=when,
+            action_url=action_url,
+            num=row['mutual_commitment'],)
+        messages.append((subject, msg, from_email, [row['contact__email']]))
+    return messages
+
+
+def mark_notified(action, attendees):
+    """
+    Records that `attendees` (values() rows) were notified, and adds them to the committed count.
+    Each row is claimed with its own conditional update, so when runs overlap every attendee
+    is marked, counted and mailed by exactly one of them.
+    Unlike Attendee.save(), this doesn't fire the post_save signals again.
+    Returns the ids of the attendees this run marked.
+    """
+    notified = now()
+    marked = []
+    with transaction.atomic():
+        for row in attendees:
+            if Attendee.objects.filter(id=row['id'], notified=None).update(
+                    notified=notified, promised=Coalesce('promised', Value(notified))):
+                marked.append(row['id'])
+    if marked:
+        action.add_committed(len(marked))
+    return marked
+
+
+def send_marked(action, attendees, action_url):
+    """
+    Marks `attendees` as notified, and mails the ones this run marked. Returns how many were mailed
+    """
+    marked = set(mark_notified(action, attendees))
+    to_send = [row for row in attendees if row['id'] in marked]
+    if to_send:
+        queue_mass_mail(render_messages(action, to_send, action_url))
+    return len(to_send)
+
+
 def notify_commitments(action, threshold, action_url):
     """
     Send notification email to all attendees who agreed to commit if at least 'threshold'
@@ -32,28 +89,38 @@ def notify_commitments(action, threshold, action_url):
         return 0
     attendees = action.attendee_set.filter(promised__isnull=False, mutual_commitment=0) | action.attendee_set.filter(mutual_commitment__lte=threshold)
     if attendees.count() >= threshold:
-        to_send = attendees.filter(notified=None, mutual_commitment__gt=0)
-        subject = "[XR] We've got enough to commit to %s" % action.name
-        messages = []
-        modified = set()
-        from_email = settings.DEFAULT_FROM_EMAIL
-        when = dateformat.format(localtime(action.when), 'l, F jS @ g:iA')
-        for attendee in to_send:
-            if attendee in modified:
-                continue
-            full_name = '%s %s' % (attendee.contact.first_name, attendee.contact.last_name)
-            msg = MESSAGE.format(
-                name=full_name,
-                action_name=action.name,
-                action_date=when,
-                action_url=action_url,
-                num=attendee.mutual_commitment,)
-            messages.append((subject, msg, from_email, [attendee.contact.email]))
-            attendee.notified = now()
-            if not attendee.promised:
-                attendee.promised = now()
-            modified.add(attendee)
-        send_mass_mail(messages)
-        for attendee in modified:
-            attendee.save()
-        return len(messages)
+        to_send = attendees.filter(notified=None, mutual_commitment__gt=0).values(*ATTENDEE_FIELDS)
+        to_send = list({row['id']: row for row in to_send}.values())
+        return send_marked(action, to_send, action_url)
+
+
+def crossed_threshold(committed, thresholds):
+    """
+    Returns the highest mutual commitment threshold that has been reached,
+    given the number of committed attendees and the sorted thresholds of pending attendees.
+    Pending attendees count towards every threshold at or above their own.
+    """
+    reached = 0
+    for num, threshold in enumerate(thresholds, 1):
+        if committed + num >= threshold:
+            reached = threshold
+    return reached
+
+
+def notify_crossed(action, action_url):
+    """
+    Notifies the attendees whose mutual commitment threshold has just been reached.
+    Only the thresholds of pending attendees are read; the committed attendees
+    are counted by Action.committed_count.
+    """
+    if now() > action.when:
+        return 0
+    committed = Action.objects.filter(pk=action.pk).values_list('committed_count', flat=True)[0]
+    pending = action.attendee_set.filter(notified=None, mutual_commitment__gt=0)
+    thresholds = pending.order_by('mutual_commitment').values_list('mutual_commitment', flat=True)
+    reached = crossed_threshold(committed, thresholds)
+    if not reached:
+        return 0
+    to_send = list(pending.filter(mutual_commitment__lte=reached).values(*ATTENDEE_FIELDS))
+    # another run may have got to some of them first
+    return send_marked(action, to_send, action_url)
@@ -0,0 +1,115 @@
+"""
+Month calendar grid for the actions list.
+
+The grid is built from a single query joining actions to their tags
+and cached per (month, tag filter, visibility class) until an action changes.
+"""
+import calendar
+
+from collections import defaultdict
+from datetime import timedelta
+from hashlib import md5
+
+from django.core.cache import cache
+from django.utils.timezone import localtime
+
+from extinctionr.utils import get_generation
+from .models import Action
+
+
+EVENT_COLORS = {
+    'talk': 'xr-bg-pink',
+    'action': 'xr-bg-green',
+    'ally': 'xr-bg-light-green',
+    'meeting': 'xr-bg-lemon',
+    'orientation': 'xr-bg-purple',
+    'art': 'xr-bg-warm-yellow',
+    'nvda': 'xr-bg-light-blue',
+    'regen': 'xr-warm-yellow xr-bg-dark-blue',
+}
+
+GRID_TIMEOUT = 60 * 60 * 24
+
+
+def get_month_events(visibility, start_date, end_date, tag_filter=''):
+    """
+    Returns a dict of local date -> list of events between start_date and end_date.
+    Events are plain dicts with the attributes used by the calendar template.
+    """
+    qset = Action.objects.for_visibility(visibility).filter(when__date__range=(start_date, end_date))
+    if tag_filter:
+        # filter in a subquery, so that the join below returns every tag of the action
+        qset = qset.filter(pk__in=Action.objects.filter(tags__name=tag_filter).values('pk'))
+    events = {}
+    for pk, name, slug, when, public, tag in qset.values_list('id', 'name', 'slug', 'when', 'public', 'tags__name'):
+        event = events.get(pk)
+        if event is None:
+            action = Action(id=pk, name=name, slug=slug, when=when, public=public)
+            event = events[pk] = {
+                'when': when,
+                'public': public,
+                'html_title': action.html_title,
+                'get_absolute_url': action.get_absolute_url(),
+                'tags': [],
+            }
+        if tag:
+            event['tags'].append(tag)
+
+    month_events = defaultdict(list)
+    for event in events.values():
+        # Convert day to local day so actions land in the right day for current view.
+        month_events[localtime(event['when']).date()].append(event)
+    return month_events
+
+
+def build_month_grid(current_date, visibility, tag_filter='', include_past=7):
+    start_date = current_date - timedelta(days=include_past)
+    end_date = start_date + timedelta(days=38)
+    month_events = get_month_events(visibility, start_date, end_date, tag_filter)
+
+    this_month = []
+    this_week = []
+    cal_days = calendar.Calendar(firstweekday=6).itermonthdates(current_date.year, current_date.month)
+    for daynum, mdate in enumerate(cal_days, 1):
+        todays_events = month_events.get(mdate, [])
+        obj = {
+            'day': mdate,
+            'events': todays_events,
+            'bg': '',
+        }
+        if mdate.month == current_date.month:
+            for event in todays_events:
+                color = next((EVENT_COLORS[t] for t in event['tags'] if t in EVENT_COLORS), None)
+                if color:
+                    obj['bg'] = color
+        else:
+            # previous month
+            obj['bg'] = 'bg-light'
+        this_week.append(obj)
+        if daynum % 7 == 0:
+            this_month.append(this_week)
+            this_week = []
+    if this_week:
+        this_month.append(this_week)
+    return this_month
+
+
+def get_month_grid(current_date, visibility, tag_filter='', today=None):
+    """
+    Returns the cached grid for the month, marking today's date
+    """
+    key = 'actions:grid:%d:%s:%s:%s' % (
+        get_generation('actions'),
+        current_date.strftime('%Y-%m'),
+        visibility,
+        md5(tag_filter.encode('utf8')).hexdigest())
+    month = cache.get(key)
+    if month is None:
+        month = build_month_grid(current_date, visibility, tag_filter)
+        cache.set(key, month, GRID_TIMEOUT)
+    if today:
+        for week in month:
+            for day in week:
+                if day['day'] == today:
+                    day['today'] = True
+    return month
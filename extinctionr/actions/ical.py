@@ -0,0 +1,93 @@
+"""
+iCal feed for actions.
+
+Every VEVENT block is cached, keyed on the action's modified time and the 'feed' generation,
+which is bumped when action tags change, so a feed only serializes the actions that changed
+since the last poll.
+"""
+from datetime import timedelta
+from hashlib import md5
+
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.http import quote_etag
+from extinctionr.utils import get_generation
+
+
+CALENDAR_NAME = 'XR Mass Events'
+VEVENT_TIMEOUT = 60 * 60 * 24 * 7
+FEED_TIMEOUT = 60 * 60 * 24
+
+
+def feed_validators(actions, *extra):
+    """
+    Returns (etag, last_modified) for the feed of `actions`, using one aggregate query
+    """
+    agg = actions.prefetch_related(None).order_by().aggregate(latest=Max('modified'), num=Count('id', distinct=True))
+    latest = agg['latest']
+    last_modified = int(latest.timestamp()) if latest else None
+    tag = ':'.join(str(v) for v in (latest, agg['num'], get_generation('feed')) + extra)
+    return quote_etag(md5(tag.encode('utf8')).hexdigest()), last_modified
+
+
+def render_vevent(action, request):
+    from ics import Event
+    evt = Event()
+    evt.uid = '{}@{}'.format(action.id, request.get_host())
+    evt.name = action.html_title
+    evt.description = action.description
+    evt.categories = action.tag_names
+    evt.last_modified = action.modified
+    evt.url = request.build_absolute_uri(action.get_absolute_url())
+    evt.begin = action.when
+    evt.duration = timedelta(hours=1)
+    evt.location = action.location
+    return str(evt).rstrip('\r\n') + '\r\n'
+
+
+def get_vevents(actions, request):
+    """
+    Returns the serialized VEVENT blocks for `actions`, in order.
+    Only actions missing from the cache are loaded and rendered.
+    """
+    base = md5(request.build_absolute_uri('/').encode('utf8')).hexdigest()
+    generation = get_generation('feed')
+    keys = {}
+    for pk, modified in actions.prefetch_related(None).values_list('id', 'modified'):
+        keys[pk] = 'actions:vevent:%d:%s:%d:%s' % (pk, modified.timestamp(), generation, base)
+    blocks = cache.get_many(list(keys.values()))
+    missing = [pk for pk, key in keys.items() if key not in blocks]
+    if missing:
+        rendered = {}
+        for action in actions.filter(pk__in=missing):
+            rendered[keys[action.pk]] = render_vevent(action, request)
+        cache.set_many(rendered, VEVENT_TIMEOUT)
+        blocks.update(rendered)
+    return [blocks[key] for key in keys.values() if key in blocks]
+
+
+def iter_calendar(vevents, name=CALENDAR_NAME):
+    yield 'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{}\r\n'.format(name)
+    yield from vevents
+    yield 'END:VCALENDAR\r\n'
+
+
+def _cache_chunks(key, chunks):
+    body = []
+    for chunk in chunks:
+        body.append(chunk)
+        yield chunk
+    cache.set(key, ''.join(body), FEED_TIMEOUT)
+
+
+def feed_response(actions, request, etag):
+    """
+    Returns the feed body rendered for `etag`, or streams and caches a new one
+    """
+    key = 'actions:feed:%s' % etag.strip('"')
+    body = cache.get(key)
+    if body is not None:
+        return HttpResponse(body, content_type='text/calendar')
+    chunks = iter_calendar(get_vevents(actions, request))
+    return StreamingHttpResponse(_cache_chunks(key, chunks), content_type='text/calendar')
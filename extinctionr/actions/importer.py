@@ -0,0 +1,48 @@
+"""
+Reads sign-in sheets for Action.bulk_signup
+"""
+import csv
+
+
+def find_field(fields, search_for):
+    for field in fields:
+        if field.lower().strip().startswith(search_for):
+            return field
+    return None
+
+
+def read_signups(fp):
+    """
+    Yields signup rows from a CSV file with (case insensitive) columns:
+    email, name or first name/last name, and optionally role, notes, promised and commit
+    """
+    reader = csv.DictReader(fp)
+    fields = reader.fieldnames or []
+    email_field = find_field(fields, 'email')
+    if not email_field:
+        raise ValueError('email')
+    name_field = find_field(fields, ('name', 'full name'))
+    first_name_field = find_field(fields, ('first', 'fname'))
+    last_name_field = find_field(fields, ('last', 'lname'))
+    role_field = find_field(fields, 'role')
+    notes_field = find_field(fields, ('notes', 'note'))
+    promised_field = find_field(fields, 'promise')
+    commit_field = find_field(fields, 'commit')
+
+    for row in reader:
+        signup = {'email': row[email_field].strip()}
+        if first_name_field and last_name_field:
+            signup['first_name'] = row[first_name_field].strip()
+            signup['last_name'] = row[last_name_field].strip()
+        if name_field:
+            signup['name'] = row[name_field].strip()[:100]
+        if role_field:
+            signup['role'] = row[role_field].strip()
+        if notes_field:
+            signup['notes'] = row[notes_field].strip()
+        if promised_field:
+            signup['promised'] = row[promised_field].strip().lower() in ('1', 'y', 'yes', 'true', 'x')
+        if commit_field:
+            commit = row[commit_field].strip()
+            signup['commit'] = abs(int(commit)) if commit.isdigit() else 0
+        yield signup
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+from extinctionr.actions.models import Action
+from extinctionr.actions.importer import read_signups
+
+
+class Command(BaseCommand):
+    help = 'Signs up everyone in a CSV sign-in sheet for an action'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', type=str, help='slug of the action')
+        parser.add_argument('filename', type=str)
+
+    def handle(self, *args, **kwargs):
+        try:
+            action = Action.objects.get(slug=kwargs['action'])
+        except Action.DoesNotExist:
+            raise CommandError('No action with slug %s' % kwargs['action'])
+        with open(kwargs['filename'], 'r') as fp:
+            try:
+                num = action.bulk_signup(read_signups(fp))
+            except ValueError:
+                raise CommandError('The CSV file needs an email column')
+        self.stdout.write('Added %d attendees to %s' % (num, action))
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def count_commitments(apps, schema_editor):
+    Action = apps.get_model('actions', 'Action')
+    committed = Action.objects.annotate(num=models.Count(
+        'attendee',
+        filter=models.Q(attendee__mutual_commitment=0) | models.Q(attendee__notified__isnull=False)))
+    for pk, num in committed.values_list('pk', 'num'):
+        Action.objects.filter(pk=pk).update(committed_count=num)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0021_auto_20190718_1038'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='committed_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Attendees committed unconditionally, or whose mutual commitment was met'),
+        ),
+        migrations.AddIndex(
+            model_name='attendee',
+            index=models.Index(fields=['action', 'notified', 'mutual_commitment'], name='attendee_pending_idx'),
+        ),
+        migrations.RunPython(count_commitments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+from django.utils.html import strip_tags
+from markdownx.utils import markdownify
+
+
+FIELDS = {
+    'Action': ('description',),
+}
+
+
+def render_html(apps, schema_editor):
+    for model_name, fields in FIELDS.items():
+        model = apps.get_model('actions', model_name)
+        changed = []
+        for obj in model.objects.all():
+            for name in fields:
+                setattr(obj, name + '_html', markdownify(strip_tags(getattr(obj, name))))
+            changed.append(obj)
+        model.objects.bulk_update(changed, [name + '_html' for name in fields], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('actions', '0022_commitment_tracking'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='action',
+            name='description_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(render_html, migrations.RunPython.noop),
+    ]
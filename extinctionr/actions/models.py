@@ -2,7 +2,7 @@ import datetime
 from hashlib import md5
 from urllib.parse import quote
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
 from django.contrib.sites.shortcuts import get_current_site
 from django.urls import reverse
@@ -11,7 +11,7 @@ from django.utils.safestring import mark_safe
 from django.utils.html import linebreaks
 from contacts.models import Contact
 from extinctionr.info.models import Photo
-from extinctionr.utils import get_contact
+from extinctionr.utils import get_contact, get_contacts, tag_contacts, base_url, bump_generation, BATCH_SIZE, RenderedMarkdownMixin
 from markdownx.models import MarkdownxField
 from markdown import markdown
 from taggit.managers import TaggableManager
@@ -19,20 +19,46 @@ from taggit.managers import TaggableManager
 
 USER_MODEL = get_user_model()
 
+
+def visibility_class(user):
+    """
+    Actions visible to a user depend only on which of these classes they fall in:
+    anonymous users see public actions, staff also see pending actions
+    """
+    if user.is_anonymous:
+        return 'anonymous'
+    elif user.is_staff:
+        return 'staff'
+    else:
+        return 'authenticated'
+
+
 class ActionManager(models.Manager):
-    def for_user(self, user):
-        qset = self.all().order_by('when')
-        if user.is_anonymous:
+    def with_tags(self):
+        """
+        Prefetches tags and photos, so that listing actions takes a fixed number of queries.
+        Use Action.tag_names instead of Action.tags.names() to read the prefetched tags.
+        """
+        return self.get_queryset().prefetch_related('tags', 'photos')
+
+    def for_user(self, user, with_tags=False):
+        return self.for_visibility(visibility_class(user), with_tags=with_tags)
+
+    def for_visibility(self, visibility, with_tags=False):
+        qset = self.with_tags() if with_tags else self.all()
+        qset = qset.order_by('when')
+        if visibility == 'anonymous':
             qset = qset.filter(public=True)
-        if not user.is_staff:
+        if visibility != 'staff':
             qset = qset.exclude(tags__name='pending')
         return qset
 
 
-class Action(models.Model):
+class Action(RenderedMarkdownMixin, models.Model):
     name = models.CharField(max_length=255, db_index=True)
     when = models.DateTimeField(db_index=True)
     description = MarkdownxField(default='', blank=True, help_text='Markdown formatted')
+    description_html = models.TextField(default='', blank=True, editable=False)
     slug = models.SlugField(unique=True, help_text='Short form of the title, for URLs')
     public = models.BooleanField(default=True, blank=True, help_text='Whether this action should be listed publicly')
     location = models.TextField(default='', blank=True, help_text='Event location will be converted to a google maps link, unless you format it as a Markdown link -- [something](http://foo.com)')
@@ -42,10 +68,13 @@ class Action(models.Model):
     show_commitment = models.BooleanField(blank=True, default=False, help_text='Whether to show the conditional commitment fields')
     max_participants = models.IntegerField(blank=True, default=0, help_text="Maximun number of people allowed to register")
     accessibility = models.TextField(default='', help_text="Indicate what the accessibility accomodations are for this location.")
+    committed_count = models.IntegerField(default=0, editable=False, help_text="Attendees committed unconditionally, or whose mutual commitment was met")
 
     tags = TaggableManager(blank=True, help_text="Attendees will automatically be tagged with these tags")
     objects = ActionManager()
 
+    markdown_fields = ('description', )
+
     @property
     def available_role_choices(self):
         for role in self.available_roles.split(','):
@@ -53,6 +82,10 @@ class Action(models.Model):
             if role:
                 yield role
     
+    @property
+    def tag_names(self):
+        return [tag.name for tag in self.tags.all()]
+
     def is_full(self):
         return self.max_participants and self.attendee_set.count() >= self.max_participants
 
@@ -64,18 +97,83 @@ class Action(models.Model):
             role = ActionRole.objects.get_or_create(name=role or '')[0]
 
         user = get_contact(email, name=name)
-        atten, created = Attendee.objects.get_or_create(action=self, contact=user, role=role)
-        if not created:
-            if notes:
-                atten.notes = notes
-        else:
-            atten.notes = notes
-            atten.mutual_commitment = commit
-        if promised:
-            atten.promised = now()
-        atten.save()
+        with transaction.atomic():
+            # create the attendee in one go, so that the signals see its commitment
+            atten, created = Attendee.objects.get_or_create(
+                action=self,
+                contact=user,
+                role=role,
+                defaults={'notes': notes, 'mutual_commitment': commit, 'promised': now() if promised else None})
+            if not created:
+                if notes:
+                    atten.notes = notes
+                if promised:
+                    atten.promised = now()
+                atten.save()
         return atten
 
+    def add_committed(self, num=1):
+        Action.objects.filter(pk=self.pk).update(committed_count=models.F('committed_count') + num)
+        # update() doesn't send post_save, and the pages show the count
+        transaction.on_commit(lambda: bump_generation('actions'))
+
+    def recount_commitments(self):
+        """
+        Recomputes committed_count from the attendees
+        """
+        self.committed_count = self.attendee_set.filter(models.Q(mutual_commitment=0) | models.Q(notified__isnull=False)).count()
+        Action.objects.filter(pk=self.pk).update(committed_count=self.committed_count)
+        transaction.on_commit(lambda: bump_generation('actions'))
+        return self.committed_count
+
+    def bulk_signup(self, rows):
+        """
+        Signs up many people at once, e.g. from a sign-in sheet.
+        `rows` are dicts with the arguments of signup(): email, role, name, notes, promised and commit.
+        Attendees are inserted without firing the per-attendee signals; action tags are applied
+        and commitments are checked once, at the end.
+        Returns the number of new attendees.
+        """
+        rows = [row for row in rows if row.get('email', '').strip()]
+        role_names = set(row.get('role') or '' for row in rows)
+        ActionRole.objects.bulk_create([ActionRole(name=name) for name in role_names], ignore_conflicts=True)
+        roles = {role.name: role for role in ActionRole.objects.filter(name__in=role_names)}
+        contacts = get_contacts(rows)
+
+        attendees = {(a.contact_id, a.role_id): a for a in self.attendee_set.all()}
+        new = []
+        changed = {}
+        when = now()
+        for row in rows:
+            contact = contacts[row['email'].lower().strip()]
+            role = roles[row.get('role') or '']
+            notes = row.get('notes', '')
+            atten = attendees.get((contact.id, role.id))
+            if atten is None:
+                atten = Attendee(action=self, contact=contact, role=role, notes=notes, mutual_commitment=row.get('commit') or 0)
+                attendees[(contact.id, role.id)] = atten
+                new.append(atten)
+            elif notes:
+                atten.notes = notes
+            if row.get('promised'):
+                atten.promised = when
+            if atten.pk:
+                changed[atten.pk] = atten
+
+        from extinctionr.circles.models import ContactFacet
+        with transaction.atomic():
+            Attendee.objects.bulk_create(new, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            Attendee.objects.bulk_update(changed.values(), ['notes', 'promised'], batch_size=BATCH_SIZE)
+            ContactFacet.objects.add(ContactFacet.ACTION, self.id, [a.contact_id for a in new])
+            # the bulk operations skip invalidate_attendees
+            transaction.on_commit(lambda: bump_generation('attendees'))
+            tag_contacts([c.id for c in contacts.values()], self.tags.all())
+            self.recount_commitments()
+
+        from .comm import notify_crossed
+        notify_crossed(self, '%s%s' % (base_url(), self.get_absolute_url()))
+        return len(new)
+
     @property
     def html_title(self):
         return mark_safe(self.name.replace('\n','<br>').replace('\\n', '<br>'))
@@ -88,6 +186,9 @@ class Action(models.Model):
         return '%s on %s' % (self.name, self.when.strftime('%b %e, %Y @ %H:%M'))
 
     def save(self, *args, **kwargs):
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            # committed_count is maintained with F() updates, don't overwrite it with a stale value
+            kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and f.name != 'committed_count']
         ret = super().save(*args, **kwargs)
         for role in self.available_role_choices:
             ActionRole.objects.get_or_create(name=role)
@@ -121,6 +222,10 @@ class Attendee(models.Model):
 
     class Meta:
         unique_together = ('action', 'contact', 'role')
+        indexes = [
+            # pending mutual commitments, in threshold order
+            models.Index(fields=['action', 'notified', 'mutual_commitment'], name='attendee_pending_idx'),
+        ]
 
     def __str__(self):
         return '%s %s %s' % (self.action, self.contact, self.role)
@@ -1,16 +1,55 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete, pre_save, m2m_changed
+from django.contrib.contenttypes.models import ContentType
 from django.dispatch import receiver
-from extinctionr.utils import base_url
+from taggit.models import TaggedItem
+from extinctionr.utils import base_url, bump_generation
 
-from .models import Attendee
+from .models import Action, Attendee
+
+
+def is_committed(attendee):
+    return attendee.mutual_commitment == 0 or attendee.notified is not None
+
+
+@receiver(pre_save, sender=Attendee)
+def remember_commitment(sender, instance, **kwargs):
+    """
+    Keeps the commitment of an existing attendee from before the save, for send_commit_email
+    """
+    instance._old_commitment = None
+    if not instance._state.adding:
+        instance._old_commitment = Attendee.objects.filter(pk=instance.pk).values_list('mutual_commitment', 'notified').first()
 
 
 @receiver(post_save, sender=Attendee)
-def send_commit_email(sender, instance, **kwargs):
-    from .comm import notify_commitments
-    if instance.promised or instance.mutual_commitment > 0 and not instance.notified:
-        action_url = '%s%s' % (base_url(), instance.action.get_absolute_url())
-        notify_commitments(instance.action, instance.mutual_commitment, action_url)
+def send_commit_email(sender, instance, created, **kwargs):
+    """
+    New attendees, and attendees whose commitment changed, either change the committed count
+    or change the pending thresholds, so check whether any thresholds were crossed
+    """
+    from .comm import notify_crossed
+    committed = is_committed(instance)
+    if created:
+        if committed:
+            instance.action.add_committed()
+    else:
+        old = getattr(instance, '_old_commitment', None)
+        if old is None or old == (instance.mutual_commitment, instance.notified):
+            return
+        was_committed = old[0] == 0 or old[1] is not None
+        if was_committed != committed:
+            instance.action.add_committed(1 if committed else -1)
+    action = instance.action
+    action_url = '%s%s' % (base_url(), action.get_absolute_url())
+    transaction.on_commit(lambda: notify_crossed(action, action_url))
+
+
+@receiver(post_delete, sender=Attendee)
+def remove_commitment(sender, instance, **kwargs):
+    if is_committed(instance):
+        Action.objects.filter(pk=instance.action_id).update(committed_count=F('committed_count') - 1)
 
 
 @receiver(post_save, sender=Attendee)
@@ -18,3 +57,31 @@ def auto_tag_attendee(sender, instance, **kwargs):
     action_tags = instance.action.tags.all()
     if action_tags:
         instance.contact.tags.add(*action_tags)
+
+
+@receiver(post_save, sender=Action)
+@receiver(post_delete, sender=Action)
+def invalidate_actions(sender, instance, **kwargs):
+    bump_generation('actions')
+
+
+@receiver(m2m_changed, sender=Action.tags.through)
+def invalidate_action_tags(sender, instance, **kwargs):
+    if isinstance(instance, Action):
+        bump_generation('actions')
+        bump_generation('feed')
+
+
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_tagged_action(sender, instance, **kwargs):
+    # tags edited through TaggedItem directly (e.g. the admin inline) don't send m2m_changed
+    if instance.content_type_id == ContentType.objects.get_for_model(Action).id:
+        bump_generation('actions')
+        bump_generation('feed')
+
+
+@receiver(post_save, sender=Attendee)
+@receiver(post_delete, sender=Attendee)
+def invalidate_attendees(sender, instance, **kwargs):
+    bump_generation('attendees')
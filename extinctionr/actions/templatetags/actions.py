@@ -19,7 +19,7 @@ def recent_actions(*args, **kwargs):
 @register.inclusion_tag('highlight_action.html')
 def highlight_action(*args, **kwargs):
     try:
-        action = models.Action.objects.filter(public=True, tags__name='highlight', when__gte=now())[0]
+        action = models.Action.objects.with_tags().filter(public=True, tags__name='highlight', when__gte=now())[0]
     except IndexError:
         action = None
     return {'action': action}
@@ -1,3 +1,158 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.template import Context, Template
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+
+from extinctionr.info.mail import send_queued
+from extinctionr.tests import CacheTestCase
+from extinctionr.utils import bump_generation, get_generation
+from .comm import ATTENDEE_FIELDS, crossed_threshold, mark_notified
+from .models import Action
+
+
+def make_actions(num, start=0, tags=('talk', 'highlight')):
+    when = now() + timedelta(days=1)
+    for i in range(start, start + num):
+        action = Action.objects.create(name='Action %d' % i, slug='action-%d' % i, when=when + timedelta(hours=i))
+        action.tags.add(*tags)
+
+
+def count_queries(func):
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+    return len(ctx.captured_queries)
+
+
+class ActionListingQueryTest(CacheTestCase):
+    """
+    Listing actions must take the same number of queries, no matter how many actions there are
+    """
+    def assertFixedQueries(self, func, expected):
+        make_actions(2)
+        few = count_queries(func)
+        make_actions(10, start=2)
+        many = count_queries(func)
+        self.assertEqual(few, many)
+        self.assertEqual(many, expected)
+
+    def test_for_user_with_tags(self):
+        def list_tags():
+            for action in Action.objects.for_user(AnonymousUser(), with_tags=True):
+                action.tag_names
+                list(action.photos.all())
+        # actions, tags, photos
+        self.assertFixedQueries(list_tags, 3)
+
+    def test_tag_names_uses_prefetch(self):
+        make_actions(1, tags=('talk', 'art'))
+        action = Action.objects.with_tags().get()
+        with self.assertNumQueries(0):
+            self.assertEqual(sorted(action.tag_names), ['art', 'talk'])
+
+    def test_template_tags(self):
+        template = Template('{% load actions %}{% recent_actions adverb="upcoming" %}{% highlight_action %}')
+        self.assertFixedQueries(lambda: template.render(Context()), 4)
+
+
+class CommitmentTest(CacheTestCase):
+    def test_crossed_threshold(self):
+        self.assertEqual(crossed_threshold(0, []), 0)
+        self.assertEqual(crossed_threshold(0, [3, 3]), 0)
+        self.assertEqual(crossed_threshold(1, [3, 3]), 3)
+        self.assertEqual(crossed_threshold(5, [2, 10]), 2)
+        self.assertEqual(crossed_threshold(8, [2, 10]), 10)
+
+    def test_bulk_signup_notifies_once(self):
+        action = Action.objects.create(name='Mass action', slug='mass-action', when=now() + timedelta(days=1))
+        rows = [
+            {'email': 'a@example.com', 'name': 'A Person'},
+            {'email': 'b@example.com', 'name': 'B Person', 'role': 'marshal'},
+            {'email': 'c@example.com', 'name': 'C Person', 'commit': 3},
+            {'email': 'd@example.com', 'name': 'D Person', 'commit': 10},
+        ]
+        self.assertEqual(action.bulk_signup(rows), 4)
+        self.assertEqual(send_queued(), (1, 0))
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['c@example.com'])
+        action.refresh_from_db()
+        self.assertEqual(action.committed_count, 3)
+        self.assertEqual(action.recount_commitments(), 3)
+        # signing up again doesn't add anyone
+        self.assertEqual(action.bulk_signup(rows), 0)
+
+    def test_changed_commitment(self):
+        action = Action.objects.create(name='Mass action', slug='mass-action', when=now() + timedelta(days=1))
+        attendee = action.signup('a@example.com', '', name='A Person', commit=5)
+        action.refresh_from_db()
+        self.assertEqual(action.committed_count, 0)
+        attendee.mutual_commitment = 0
+        attendee.save()
+        action.refresh_from_db()
+        self.assertEqual(action.committed_count, 1)
+        attendee.mutual_commitment = 5
+        attendee.save()
+        action.refresh_from_db()
+        self.assertEqual(action.committed_count, 0)
+        self.assertEqual(action.recount_commitments(), 0)
+
+    def test_mark_notified_once(self):
+        action = Action.objects.create(name='Mass action', slug='mass-action', when=now() + timedelta(days=1))
+        action.signup('a@example.com', '', name='A Person', commit=5)
+        rows = list(action.attendee_set.values(*ATTENDEE_FIELDS))
+        self.assertEqual(mark_notified(action, rows), [rows[0]['id']])
+        # an overlapping run with the same rows doesn't count or mail them again
+        self.assertEqual(mark_notified(action, rows), [])
+        action.refresh_from_db()
+        self.assertEqual(action.committed_count, 1)
+
+    def test_save_new_action_with_pk(self):
+        Action.objects.create(pk=1000, name='Numbered', slug='numbered', when=now())
+        self.assertTrue(Action.objects.filter(pk=1000).exists())
+
+
+class RenderedMarkdownTest(CacheTestCase):
+    def test_description_html(self):
+        action = Action.objects.create(name='Rally', slug='rally', when=now(), description='**loud**')
+        self.assertIn('<strong>loud</strong>', action.description_html)
+        action.description = '*quiet*'
+        action.save(update_fields=['description'])
+        action.refresh_from_db()
+        self.assertIn('<em>quiet</em>', action.description_html)
+
+
+class ConditionalGetTest(CacheTestCase):
+    def test_show_action_not_modified(self):
+        action = Action.objects.create(name='Rally', slug='rally', when=now() + timedelta(days=1))
+        client = Client()
+        response = client.get('/action/rally/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(client.get('/action/rally/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        action.signup('someone@example.com', 'marshal', name='Some One')
+        self.assertEqual(client.get('/action/rally/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class GenerationTest(CacheTestCase):
+    def test_evicted_generation_is_not_reused(self):
+        cache.clear()
+        first = get_generation('test')
+        bump_generation('test')
+        bumped = get_generation('test')
+        self.assertGreater(bumped, first)
+        # the cache may drop the counter at any time, e.g. when LocMemCache culls it
+        cache.delete('generation:test')
+        self.assertGreater(get_generation('test'), bumped)
+
+    def test_bulk_signup_bumps_generations(self):
+        action = Action.objects.create(name='Sign-in sheet', slug='sign-in-sheet', when=now() + timedelta(days=1))
+        actions, attendees = get_generation('actions'), get_generation('attendees')
+        with self.captureOnCommitCallbacks(execute=True):
+            action.bulk_signup([{'email': 'a@example.com', 'name': 'A Person'}])
+        self.assertGreater(get_generation('actions'), actions)
+        self.assertGreater(get_generation('attendees'), attendees)
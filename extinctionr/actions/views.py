@@ -1,37 +1,41 @@
-import calendar
-import csv
-
-from collections import defaultdict
 from datetime import timedelta, datetime
-from dateutil import tz
 from urllib.parse import urlencode
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.contrib.sites.shortcuts import get_current_site
 from django.contrib import messages
 from django.core import signing
+from django.core.cache import cache
+from django.core.exceptions import PermissionDenied
 from django.db import IntegrityError
+from django.db.models import Count, Max
 from django.http import JsonResponse, HttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.utils.cache import get_conditional_response
 from django.utils.html import strip_tags
 from django.utils.http import http_date
 from django.utils.timezone import now
 from django.urls import reverse
-from django.views.decorators.cache import never_cache, cache_page
+from django.views.decorators.cache import never_cache
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
 
 from django import forms
 from phonenumber_field.formfields import PhoneNumberField
 
-from extinctionr.utils import get_last_contact, set_last_contact, get_contact
-from .models import Action, ActionRole, Attendee, TalkProposal
+from extinctionr.utils import BATCH_SIZE, get_last_contact, page_cache, page_condition, set_last_contact, stream_csv, user_contact
+from .models import Action, ActionRole, Attendee, TalkProposal, visibility_class
 from .comm import notify_commitments
+from .grid import get_month_grid
+from .ical import feed_validators, feed_response
 
 
 BOOTSTRAP_ATTRS = {'class': 'form-control text-center'}
 
+TOKEN_TIMEOUT = 300
+
 class ActionForm(forms.ModelForm):
     class Meta:
         model = Action
@@ -62,6 +66,24 @@ class TalkProposalForm(forms.Form):
     phone = PhoneNumberField(label="Phone Number", required=False, widget=forms.TextInput(attrs={'class': 'form-control text-center', 'placeholder': 'Phone Number'}))
 
 
+def _token_visibility(token):
+    """
+    Returns the visibility class of the user who signed the calendar token.
+    The user lookup is cached, because calendar clients poll constantly.
+    """
+    try:
+        user_id = signing.Signer().unsign(token)
+    except signing.BadSignature:
+        raise PermissionDenied
+    key = 'actions:token-visibility:%s' % user_id
+    visibility = cache.get(key)
+    if visibility is None:
+        user = get_object_or_404(get_user_model(), pk=user_id)
+        visibility = visibility_class(user)
+        cache.set(key, visibility, TOKEN_TIMEOUT)
+    return visibility
+
+
 def _get_actions(request, whatever='', include_future=True, include_past=7):
     token = request.GET.get('token', '')
     req_date = request.GET.get('month','')
@@ -70,15 +92,10 @@ def _get_actions(request, whatever='', include_future=True, include_past=7):
     today = now().date()
     current_date = today.replace(day=1)
     if token:
-        try:
-            user_id = signing.Signer().unsign(token)
-        except signing.BadSignature:
-            return HttpResponse(status=403)
-        else:
-            user = get_user_model().objects.get(pk=user_id)
+        visibility = _token_visibility(token)
     else:
-        user = request.user
-    actions = Action.objects.for_user(user)
+        visibility = visibility_class(request.user)
+    actions = Action.objects.for_visibility(visibility, with_tags=True)
     if whatever.isdigit():
         actions = actions.filter(pk=int(whatever))
     else:
@@ -97,32 +114,29 @@ def _get_actions(request, whatever='', include_future=True, include_past=7):
             context['is_cal'] = True
     context['current_date'] = current_date
     context['today'] = today
+    context['visibility'] = visibility
     return actions, context
 
 
 def calendar_view(request, whatever):
-    from ics import Calendar, Event
     actions, ctx = _get_actions(request, include_future=True, include_past=30)
-    thecal = Calendar()
-    thecal.creator = 'XR Mass Events'
-    for action in actions:
-        evt = Event()
-        evt.uid = '{}@{}'.format(action.id, request.get_host())
-        evt.name = action.html_title
-        evt.description = action.description
-        evt.categories = action.tags.names()
-        evt.last_modified = action.modified
-        evt.url = request.build_absolute_uri(action.get_absolute_url())
-        evt.begin = action.when
-        evt.duration = timedelta(hours=1)
-        # evt.end = action.when + timedelta(hours=1)
-        evt.location = action.location
-        thecal.events.add(evt)
-    response = HttpResponse(thecal, content_type='text/calendar')
+    # feeds are shared by everyone in the same visibility class
+    etag, last_modified = feed_validators(
+        actions,
+        ctx['visibility'],
+        ctx.get('current_tag', ''),
+        ctx['current_date'],
+        request.build_absolute_uri('/'))
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = feed_response(actions, request, etag)
+    response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
     return response
 
 
-@cache_page(1200)
+@page_cache('actions')
 @csrf_protect
 def list_actions(request):
     can_add = request.user.has_perm('actions.add_action')
@@ -134,7 +148,7 @@ def list_actions(request):
         else:
             print(form.errors)
 
-    qset, ctx = _get_actions(request, include_future=False)
+    ctx = _get_actions(request, include_future=False)[1]
     if not ctx.get('is_cal'):
         actions = Action.objects.for_user(request.user).filter(when__gte=now())
         ctx['upcoming'] = actions[:6]
@@ -143,54 +157,7 @@ def list_actions(request):
     current_date = ctx['current_date']
     ctx['next_month'] = current_date + timedelta(days=31)
     ctx['last_month'] = current_date + timedelta(days=-1)
-
-    cal_days = list(calendar.Calendar(firstweekday=6).itermonthdates(current_date.year, current_date.month))
-    this_month = []
-    this_week = []
-    month_actions = defaultdict(list)
-
-    for action in qset:
-        # Convert day to local day so actions land in the right day for current view.
-        day = action.when.astimezone(tz.tzlocal()).date()
-        month_actions[day].append(action)
-
-    event_colors = {
-        'talk': 'xr-bg-pink',
-        'action': 'xr-bg-green',
-        'ally': 'xr-bg-light-green',
-        'meeting': 'xr-bg-lemon',
-        'orientation': 'xr-bg-purple',
-        'art': 'xr-bg-warm-yellow',
-        'nvda': 'xr-bg-light-blue',
-        'regen': 'xr-warm-yellow xr-bg-dark-blue',
-    }
-    for daynum, mdate in enumerate(cal_days, 1):
-        todays_actions = month_actions[mdate]
-        obj = {
-            'day': mdate,
-            'events': todays_actions,
-            'bg': '',
-        }
-        if mdate.month == current_date.month:
-            for a in todays_actions:
-                tagnames = a.tags.names()
-                for t in a.tags.names():
-                    color = event_colors.get(t, None)
-                    if color:
-                        obj['bg'] = color
-                        break
-        else:
-            # previous month
-            obj['bg'] = 'bg-light'
-        if mdate == ctx['today']:
-            obj['today'] = True
-        this_week.append(obj)
-        if daynum % 7 == 0:
-            this_month.append(this_week)
-            this_week = []
-    if this_week:
-        this_month.append(this_week)
-    ctx['month'] = this_month
+    ctx['month'] = get_month_grid(current_date, ctx['visibility'], ctx.get('current_tag', ''), today=ctx['today'])
     ctx['can_add'] = can_add
     if ctx['can_add']:
         ctx['form'] = ActionForm()
@@ -212,7 +179,23 @@ def list_actions(request):
 
 
 
-@cache_page(1200)
+def action_state(request, slug):
+    """
+    Validators for show_action, from one aggregate query over the action and its attendees
+    """
+    agg = Action.objects.filter(slug=slug).aggregate(
+        modified=Max('modified'),
+        when=Max('when'),
+        signed_up=Max('attendee__created'),
+        num=Count('attendee'))
+    if agg['modified'] is None:
+        return None
+    last_modified = max(d for d in (agg['modified'], agg['signed_up']) if d)
+    return last_modified, (agg['num'], agg['when'] < now())
+
+
+@page_condition(action_state, 'actions', 'attendees')
+@page_cache('actions', 'attendees')
 def show_action(request, slug):
     action = get_object_or_404(Action, slug=slug)
     ctx = {'action': action}
@@ -242,7 +225,7 @@ def show_action(request, slug):
             set_last_contact(request, atten.contact)
             return redirect(next_url)
     else:
-        contact = get_contact(email=request.user.email) if request.user.is_authenticated else get_last_contact(request)
+        contact = user_contact(request.user) if request.user.is_authenticated else get_last_contact(request)
         initial = {}
         if contact:
             initial['email'] = contact.email
@@ -253,7 +236,6 @@ def show_action(request, slug):
     ctx['photos'] = list(action.photos.all())
     resp = render(request, 'action.html', ctx)
     resp['Vary'] = 'Cookie'
-    resp['Last-Modified'] = http_date(action.modified.timestamp())
     if request.user.is_authenticated:
         resp['Cache-Control'] = 'private'
     return resp
@@ -275,14 +257,12 @@ def show_attendees(request, action_slug):
         # ctx = {'attendees': attendees, 'half': half, 'can_change': request.user.is_staff, 'slug': action_slug}
         # resp = render(request, 'attendees.html', ctx)
     elif out_fmt == 'csv' and request.user.has_perm('actions.view_attendee'):
-        attendees = attendees.order_by('created')
-        resp = HttpResponse()
-        resp['Content-Type'] = 'text/csv'
-        csv_writer = csv.writer(resp)
         header = ('Email', 'First Name', 'Last Name', 'Phone', 'Promised', 'Created')
-        csv_writer.writerow(header)
-        for attendee in attendees:
-            csv_writer.writerow((attendee.contact.email, attendee.contact.first_name, attendee.contact.last_name, attendee.contact.phone, attendee.promised, attendee.created.isoformat()))
+        rows = attendees.order_by('created').values_list(
+            'contact__email', 'contact__first_name', 'contact__last_name', 'contact__phone', 'promised', 'created')
+        resp = stream_csv(
+            (row[:-1] + (row[-1].isoformat(), ) for row in rows.iterator(chunk_size=BATCH_SIZE)),
+            header=header)
     return resp
 
 
@@ -339,23 +319,28 @@ def mark_promised(request, action_slug):
 @login_required
 @never_cache
 def list_proposals(request):
-    ctx = {
-        'talks': TalkProposal.objects.select_related('requestor').order_by('-responded', 'created')
-    }
-    template = 'list_talks'
+    talks = TalkProposal.objects.select_related('requestor').order_by('-responded', 'created')
     if request.GET.get('format', 'html') == 'csv':
-        template += '.csv'
-        content_type = 'text/csv'
-        content_disposition = 'attachment; filename="talks.csv"'
-    else:
-        template += '.html'
-        content_type = 'text/html'
-        content_disposition = None
-    response = render(request, template, ctx)
-    response['content-type'] = content_type
-    if content_disposition:
-        response['content-disposition'] = content_disposition
-    return response
+        header = ('id', 'date', 'requestor', 'email', 'phone', 'location', 'responded', 'talk_url')
+        return stream_csv(talk_rows(talks), filename='talks.csv', header=header)
+    return render(request, 'list_talks.html', {'talks': talks})
+
+
+def talk_rows(talks):
+    # TalkProposal.get_talk_url() without a query per talk
+    domain = get_current_site(None).domain
+    converted = set(Action.objects.filter(slug__startswith='xr-talk-').values_list('slug', flat=True))
+    for talk in talks.iterator(chunk_size=BATCH_SIZE):
+        slug = 'xr-talk-%d' % talk.id
+        yield (
+            talk.id,
+            talk.created.isoformat(),
+            talk.requestor,
+            talk.requestor.email,
+            talk.requestor.phone or '',
+            talk.location,
+            talk.responded.isoformat() if talk.responded else '',
+            'https://%s%s' % (domain, Action(slug=slug).get_absolute_url()) if slug in converted else '')
 
 
 
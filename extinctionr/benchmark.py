@@ -0,0 +1,236 @@
+"""
+Benchmarks for the public pages.
+
+seed() fills the database with realistic volumes, run() measures the query count
+and latency of each page with a cold cache, and check() compares the results
+to the budgets recorded in benchmarks.json. See the benchmark management command.
+"""
+import json
+import os.path
+import random
+import time
+
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
+from taggit.models import Tag, TaggedItem
+
+from contacts.models import Contact
+from extinctionr.actions.models import Action, ActionRole, Attendee
+from extinctionr.circles.models import Circle, CircleMember, ContactFacet, ContactSearchTerm
+from extinctionr.info.models import PressRelease
+from extinctionr.utils import rerender_markdown
+
+
+BUDGET_FILE = os.path.join(os.path.dirname(__file__), 'benchmarks.json')
+
+# the benchmark and the tests clear the cache, so they get one of their own instead of the site's
+LOCAL_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'extinctionr-benchmark',
+    }
+}
+
+VOLUMES = {
+    'small': {
+        'actions': 60,
+        'contacts': 300,
+        'attendees': 600,
+        'circle_depth': 3,
+        'circle_fanout': 3,
+        'members': 300,
+        'press_releases': 20,
+    },
+    'full': {
+        'actions': 3000,
+        'contacts': 30000,
+        'attendees': 40000,
+        'circle_depth': 4,
+        'circle_fanout': 4,
+        'members': 15000,
+        'press_releases': 300,
+    },
+}
+
+ACTION_TAGS = ('talk', 'action', 'meeting', 'orientation', 'art', 'nvda', 'regen', 'pending', 'highlight')
+
+DESCRIPTION = '''Join us for **{}**!
+
+* bring a friend
+* bring water
+* [more info](https://xrmass.org/)
+'''
+
+# pages are (name, url, as_staff)
+PAGES = (
+    ('list_actions', '/action/', False),
+    ('list_actions_month', '/action/?month={month}', False),
+    ('show_action', '/action/{action}/', False),
+    ('calendar_view', '/action/ical/all', False),
+    ('top_level', '/circle/', False),
+    ('top_level_staff', '/circle/', True),
+    ('circle', '/circle/{circle}/', False),
+    ('circle_staff', '/circle/{circle}/', True),
+    ('pr_list', '/pr/', False),
+    ('info', '/', False),
+)
+
+
+def seed(actions, contacts, attendees, circle_depth, circle_fanout, members, press_releases):
+    rnd = random.Random(1)
+    start = now() - timedelta(days=365)
+
+    Action.objects.bulk_create(
+        Action(
+            name='Action %d' % i,
+            slug='bench-action-%d' % i,
+            when=start + timedelta(hours=rnd.randrange(24 * 730)),
+            public=rnd.random() > 0.1,
+            description=DESCRIPTION.format(i),
+            location='1 Main St, Boston, MA')
+        for i in range(actions))
+    rerender_markdown(Action)
+    action_ids = list(Action.objects.values_list('id', flat=True))
+    tags = [Tag.objects.get_or_create(name=name)[0] for name in ACTION_TAGS]
+    action_type = ContentType.objects.get_for_model(Action)
+    TaggedItem.objects.bulk_create(
+        TaggedItem(content_type=action_type, object_id=action_id, tag=tag)
+        for action_id in action_ids for tag in rnd.sample(tags, 2))
+
+    Contact.objects.bulk_create(
+        Contact(email='person%d@example.com' % i, first_name='First%d' % i, last_name='Last%d' % i)
+        for i in range(contacts))
+    contact_ids = list(Contact.objects.values_list('id', flat=True))
+
+    roles = [ActionRole.objects.get_or_create(name=name)[0] for name in ('', 'arrestable', 'marshal')]
+    pairs = set()
+    while len(pairs) < min(attendees, len(action_ids) * len(contact_ids)):
+        pairs.add((rnd.choice(action_ids), rnd.choice(contact_ids)))
+    Attendee.objects.bulk_create(
+        (Attendee(action_id=action_id, contact_id=contact_id, role=rnd.choice(roles), mutual_commitment=rnd.choice((0, 0, 0, 5, 50)))
+         for action_id, contact_id in pairs),
+        batch_size=500)
+
+    circles = []
+    level = [None]
+    for depth in range(circle_depth):
+        next_level = []
+        for parent in level:
+            for i in range(circle_fanout):
+                name = '%s %d' % (parent.name if parent else 'Circle', i)
+                circle = Circle.objects.create(name=name, parent=parent, purpose=DESCRIPTION.format(name))
+                next_level.append(circle)
+        circles.extend(next_level)
+        level = next_level
+    member_rows = set()
+    while len(member_rows) < min(members, len(circles) * len(contact_ids)):
+        member_rows.add((rnd.choice(circles).id, rnd.choice(contact_ids), rnd.choice(('member', 'member', 'int', 'ext'))))
+    CircleMember.objects.bulk_create(
+        (CircleMember(circle_id=circle_id, contact_id=contact_id, role=role) for circle_id, contact_id, role in member_rows),
+        batch_size=500)
+    Circle.objects.rebuild_member_counts()
+    ContactFacet.objects.rebuild()
+    ContactSearchTerm.objects.rebuild()
+
+    PressRelease.objects.bulk_create(
+        PressRelease(
+            title='Press release %d' % i,
+            slug='bench-press-release-%d' % i,
+            released=start + timedelta(days=i % 365),
+            body=DESCRIPTION.format(i))
+        for i in range(press_releases))
+    rerender_markdown(PressRelease)
+
+    user = get_user_model().objects.create(username='benchmark', email='benchmark@example.com', is_staff=True, is_superuser=True)
+    return user
+
+
+def get_urls():
+    action = Action.objects.filter(public=True).exclude(tags__name='pending').order_by('-when')[0]
+    circle = Circle.objects.filter(parent__isnull=True).order_by('pk')[0]
+    params = {
+        'month': action.when.strftime('%Y-%m'),
+        'action': action.slug,
+        'circle': circle.pk,
+    }
+    return [(name, url.format(**params), as_staff) for name, url, as_staff in PAGES]
+
+
+def _get(client, url):
+    response = client.get(url)
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+def measure(client, url, repeat=3):
+    """
+    Returns the status, number of queries and best time for `url`, with a cold cache
+    """
+    cache.clear()
+    with CaptureQueriesContext(connection) as ctx:
+        response = _get(client, url)
+    times = []
+    for i in range(repeat):
+        cache.clear()
+        started = time.perf_counter()
+        _get(client, url)
+        times.append(time.perf_counter() - started)
+    return {
+        'status': response.status_code,
+        'queries': len(ctx.captured_queries),
+        'seconds': round(min(times), 4) if times else None,
+    }
+
+
+def run(anonymous, staff, repeat=3):
+    """
+    Measures every page, with `anonymous` and `staff` test clients
+    """
+    results = {}
+    for name, url, as_staff in get_urls():
+        results[name] = measure(staff if as_staff else anonymous, url, repeat=repeat)
+        results[name]['url'] = url
+    return results
+
+
+def load_budgets():
+    try:
+        with open(BUDGET_FILE) as fp:
+            return json.load(fp)
+    except FileNotFoundError:
+        return {}
+
+
+def save_budgets(volume, results):
+    budgets = load_budgets()
+    budgets[volume] = {name: {'queries': r['queries'], 'seconds': r['seconds']} for name, r in results.items()}
+    with open(BUDGET_FILE, 'w') as fp:
+        json.dump(budgets, fp, indent=2, sort_keys=True)
+        fp.write('\n')
+
+
+def check(results, budgets, time_slack=1.5):
+    """
+    Returns a list of the pages that went over their budget, or have none.
+    Latency is allowed some slack, since it depends on the machine.
+    """
+    failures = []
+    for name, result in sorted(results.items()):
+        budget = budgets.get(name)
+        if result['status'] != 200:
+            failures.append('{}: status {}'.format(name, result['status']))
+        if not budget:
+            failures.append('{}: no budget recorded'.format(name))
+            continue
+        if result['queries'] > budget['queries']:
+            failures.append('{}: {} queries, budget is {}'.format(name, result['queries'], budget['queries']))
+        if time_slack and result['seconds'] and budget.get('seconds') and result['seconds'] > budget['seconds'] * time_slack:
+            failures.append('{}: {:.3f}s, budget is {:.3f}s'.format(name, result['seconds'], budget['seconds']))
+    return failures
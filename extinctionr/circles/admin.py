@@ -1,6 +1,6 @@
 from django.contrib import admin
-from .models import Circle, CircleMember, MembershipRequest, CircleJob, Couch, Signup
-from extinctionr.utils import get_contact
+from .models import Circle, CircleMember, MembershipRequest, CircleJob, Couch, Signup, get_my_circles
+from extinctionr.utils import user_contact
 from markdownx.admin import MarkdownxModelAdmin
 
 
@@ -28,8 +28,7 @@ class CircleAdmin(MarkdownxModelAdmin):
 
     def has_module_permission(self, request):
         if not request.user.is_anonymous:
-            contact = get_contact(email=request.user.email)
-            return contact.circlemember_set.exists()
+            return bool(get_my_circles(request.user)[0])
 
 
 @admin.register(MembershipRequest)
@@ -58,7 +57,7 @@ class CircleJobAdmin(MarkdownxModelAdmin):
 
     def save_model(self, request, obj, form, change):
         if not obj.creator:
-            obj.creator = get_contact(email=request.user.email)
+            obj.creator = user_contact(request.user, create=True)
         super().save_model(request, obj, form, change)
 
 
@@ -87,3 +86,6 @@ class CouchAdmin(MarkdownxModelAdmin):
 class SignupAdmin(admin.ModelAdmin):
     readonly_fields = ('created', 'contact') + Signup.json_fields + ('raw_data', )
     list_display = ('contact', 'created', ) + Signup.json_fields
+    list_select_related = ('contact', )
+    list_filter = ('working_group', 'committment')
+    search_fields = ('email', 'first_name', 'last_name', 'zipcode')
@@ -1,7 +1,7 @@
 from django.conf import settings
-from django.core.mail import send_mass_mail, send_mail
 from django.utils.timezone import now, localtime
 from django.utils import dateformat
+from extinctionr.info.mail import queue_mail
 from extinctionr.utils import base_url
 
 from .models import Contact
@@ -9,24 +9,29 @@ from .models import Contact
 
 def notify_circle_membership(circle, msg_type, members):
     addresses = circle.get_notification_addresses()
-    contacts = Contact.objects.filter(pk__in=members)
+    contacts = list(Contact.objects.filter(pk__in=members))
+    if not contacts:
+        return
     context = {
-        'contact': str(contacts[0]),
-        'contact_email': contacts[0].email,
         'circle': str(circle),
         'circle_url': '%s%s' % (base_url(), circle.get_absolute_url()),
     }
-    if msg_type == 'pending member':
-        context['action'] = 'wants to join'
+    if len(contacts) == 1:
+        context['contact'] = '{} <{}>'.format(contacts[0], contacts[0].email)
+        context['action'] = 'wants to join' if msg_type == 'pending member' else 'joined'
+        subject = '[XR] %s added to %s' % (msg_type, circle)
     else:
-        context['action'] = 'joined'
+        # several people at once, from an import
+        context['contact'] = '%d people' % len(contacts)
+        context['action'] = 'want to join' if msg_type == 'pending member' else 'joined'
+        context['circle'] += ':\n\n' + '\n'.join('{} <{}>'.format(c, c.email) for c in contacts)
+        subject = '[XR] %d %ss added to %s' % (len(contacts), msg_type, circle)
     message = '''
-{contact} <{contact_email}> {action} {circle}
+{contact} {action} {circle}
 
 {circle_url}#members
 '''.format(**context)
-    subject = '[XR] %s added to %s' % (msg_type, circle)
-    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, addresses)
+    queue_mail(subject, message, settings.DEFAULT_FROM_EMAIL, addresses)
 
 
 def notify_circle_job(job):
@@ -41,12 +46,12 @@ def notify_circle_job(job):
 
 {baseurl}{url}
 '''.format(who=job.filled, title=title, circle=circle, job=job.job, baseurl=base_url(), url=job.get_absolute_url())
-    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, addresses)
+    queue_mail(subject, message, settings.DEFAULT_FROM_EMAIL, addresses)
 
 
 def notify_new_signup(outreach_circle, signup):
     contact = signup.contact
-    if signup.data.get('working_group', '') == 'UNKNOWN':
+    if signup.working_group == 'UNKNOWN':
         wg_message = 'They will need help finding a working group\n'
     else:
         wg_message = ''
@@ -56,5 +61,5 @@ def notify_new_signup(outreach_circle, signup):
 To export signup data:
 {baseurl}/circle/person/join/export/
 
-'''.format(who=contact, email=contact.email, wg_message=wg_message, data=signup.data, baseurl=base_url())
-    send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, outreach_circle.get_notification_addresses())
+'''.format(who=contact, email=contact.email, wg_message=wg_message, baseurl=base_url())
+    queue_mail(subject, message, settings.DEFAULT_FROM_EMAIL, outreach_circle.get_notification_addresses())
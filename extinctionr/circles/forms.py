@@ -2,7 +2,7 @@ from django import forms
 from dal import autocomplete
 from taggit.models import Tag
 from extinctionr.actions.models import Action
-from .models import Contact
+from .models import Contact, ContactSearchTerm
 
 
 class ContactForm(forms.Form):
@@ -46,6 +46,12 @@ class FindPeopleForm(forms.Form):
         queryset=Action.objects.filter(attendee__isnull=False).distinct().order_by('-when'),
         widget=forms.SelectMultiple(attrs={'class': 'form-control'})
     )
+    match = forms.ChoiceField(
+        required=False,
+        initial='any',
+        choices=[('any', 'any of the tags or actions'), ('all', 'all of the tags or actions')],
+        widget=forms.Select(attrs={'class': 'form-control'})
+    )
 
 
 class CouchForm(forms.Form):
@@ -100,7 +106,7 @@ class ContactAutocomplete(autocomplete.Select2QuerySetView):
         qs = Contact.objects.all()
 
         if self.q:
-            qs = qs.filter(email__istartswith=self.q) | qs.filter(first_name__istartswith=self.q)
+            qs = qs.filter(pk__in=ContactSearchTerm.objects.search(self.q)).order_by('first_name', 'last_name', 'pk')
 
         return qs
 
@@ -0,0 +1,332 @@
+"""
+Bulk contact imports, for csv_import and the copy_contacts command.
+
+Rows are processed in chunks: existing contacts are found with one query per chunk,
+new contacts and addresses are created with bulk_create, and tags, circle lookups
+and membership requests are batched.
+
+Uploads are queued as ImportJobs and run by the run_imports command, or in a thread pool
+inside the web process when IMPORT_IN_PROCESS is True. The job records its progress after
+every chunk, and jobs whose worker died are queued again by requeue_stale_imports.
+"""
+import csv
+import io
+import logging
+import threading
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils.timezone import now
+from taggit.models import Tag
+
+from contacts.models import Address
+from extinctionr.actions.importer import find_field
+from extinctionr.utils import BATCH_SIZE, address_fields, batches, bulk_create_with_pks, split_name, tag_contacts, upsert_contacts
+from . import comm
+from .models import Circle, CircleMember, ImportJob, MembershipRequest
+
+
+CHUNK_SIZE = BATCH_SIZE
+IMPORT_THREADS = 2
+# a job still running after this long lost its worker, e.g. to a restart
+STALE_IMPORT_AGE = timedelta(hours=1)
+
+logger = logging.getLogger(__name__)
+
+# contact fields that are filled in when missing, like get_contact does
+CONTACT_FIELDS = ('phone', )
+
+
+def read_contacts(fp):
+    """
+    Yields contact rows from a CSV file with (case insensitive) columns: email,
+    and optionally first name, last name, phone, city, zip code, circle and tags
+    """
+    reader = csv.DictReader(fp)
+    fields = reader.fieldnames or []
+    email_field = find_field(fields, 'email')
+    if not email_field:
+        raise ValueError('email')
+    first_name_field = find_field(fields, ('first', 'fname'))
+    last_name_field = find_field(fields, ('last', 'lname'))
+    phone_field = find_field(fields, 'phone')
+    city_field = find_field(fields, ('city', 'can2_user_city'))
+    postcode_field = find_field(fields, ('zip', 'postcode', 'postal code'))
+    circle_field = find_field(fields, ('circle', 'working group', 'wg'))
+    tag_field = find_field(fields, 'tag')
+
+    for row in reader:
+        person = {'email': row[email_field].strip()}
+        if first_name_field:
+            person['first_name'] = row[first_name_field].strip()
+        if last_name_field:
+            person['last_name'] = row[last_name_field].strip()
+        if phone_field:
+            person['phone'] = row[phone_field].strip()
+        if city_field:
+            person['city'] = row[city_field].strip()
+        if postcode_field:
+            person['postcode'] = row[postcode_field].strip()
+        if circle_field:
+            person['circle'] = row[circle_field].split('-')[0].strip()
+        if tag_field:
+            person['tags'] = [t.strip() for t in row[tag_field].split(',') if t.strip()]
+        yield person
+
+
+class ContactImporter:
+    """
+    Creates or updates contacts from rows like the ones read_contacts() yields,
+    tags them and requests membership in their circle.
+    Counts what it did in `rows`, `created`, `matched` and `requested`,
+    and collects (row number, message) in `errors`.
+    `progress`, if given, is called with the importer after every chunk.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, progress=None):
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.rows = 0
+        self.created = 0
+        self.matched = 0
+        self.requested = 0
+        self.errors = []
+        self._circles = {}
+        self._tags = {}
+
+    def run(self, rows):
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self.import_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.import_chunk(chunk)
+        return self
+
+    def import_chunk(self, rows):
+        people = {}
+        for row in rows:
+            self.rows += 1
+            email = row.get('email', '').lower().strip()
+            if not email or '@' not in email:
+                self.errors.append((self.rows, 'Missing email address'))
+                continue
+            person = people.setdefault(email, {'row': self.rows})
+            # a later row for the same person fills in what the earlier ones didn't have
+            person.update((k, v) for k, v in row.items() if v)
+            person['email'] = email
+        with transaction.atomic():
+            contacts = self.upsert_contacts(people)
+            self.add_tags(people, contacts)
+            self.request_memberships(people, contacts)
+        if self.progress:
+            self.progress(self)
+
+    def upsert_contacts(self, people):
+        """
+        Returns a dict of email -> Contact for `people`, creating or filling in contacts
+        """
+        new_addresses = []
+        changed_addresses = []
+
+        def fill(contact, person):
+            first_name = person.get('first_name', '')
+            last_name = person.get('last_name', '')
+            if not (first_name and last_name):
+                first_name, last_name = split_name(person.get('name', ''))
+            extra = {k: person[k] for k in CONTACT_FIELDS if person.get(k)}
+            address = {k: person[k] for k in address_fields() if person.get(k)}
+            if contact.pk is None:
+                contact.first_name, contact.last_name = first_name, last_name
+                for k, v in extra.items():
+                    setattr(contact, k, v)
+                if address:
+                    new_addresses.append((contact, Address(**address)))
+                return False
+
+            self.matched += 1
+            dirty = False
+            for k, v in extra.items():
+                if getattr(contact, k, None) is None:
+                    setattr(contact, k, v)
+                    dirty = True
+            if last_name != '?' and contact.last_name in ('', '?', 'unknown'):
+                contact.last_name = last_name
+                dirty = True
+            if first_name and contact.first_name in ('', '?', 'unknown'):
+                contact.first_name = first_name
+                dirty = True
+            if address:
+                if contact.address is None:
+                    new_addresses.append((contact, Address(**address)))
+                    dirty = True
+                else:
+                    for k, v in address.items():
+                        setattr(contact.address, k, v)
+                    changed_addresses.append(contact.address)
+            return dirty
+
+        def save_addresses(new, changed):
+            if changed_addresses:
+                Address.objects.bulk_update(changed_addresses, address_fields(), batch_size=BATCH_SIZE)
+            if new_addresses:
+                bulk_create_with_pks(Address, [a for c, a in new_addresses])
+                for contact, address in new_addresses:
+                    contact.address = address
+
+        contacts, created = upsert_contacts(
+            people, fill,
+            update_fields=('first_name', 'last_name', 'address') + CONTACT_FIELDS,
+            before_save=save_addresses,
+            select_related=('address', ))
+        self.created += created
+        return contacts
+
+    def get_tag(self, name):
+        tag = self._tags.get(name)
+        if tag is None:
+            tag = self._tags[name] = Tag.objects.get_or_create(name=name)[0]
+        return tag
+
+    def add_tags(self, people, contacts):
+        tagged = defaultdict(list)
+        for email, person in people.items():
+            if person.get('tags'):
+                tagged[tuple(sorted(set(person['tags'])))].append(contacts[email].pk)
+        for names, contact_ids in tagged.items():
+            tag_contacts(contact_ids, [self.get_tag(name) for name in names])
+
+    def get_circle(self, name):
+        key = name.lower()
+        if key not in self._circles:
+            self._circles[key] = Circle.objects.filter(name__iexact=name).order_by('-pk').first()
+        return self._circles[key]
+
+    def request_memberships(self, people, contacts):
+        """
+        Requests membership for everyone who isn't already a member of their circle, or waiting to be
+        """
+        wanted = defaultdict(set)
+        for email, person in people.items():
+            name = person.get('circle')
+            if not name:
+                continue
+            circle = self.get_circle(name)
+            if circle is None:
+                self.errors.append((person['row'], 'Could not find circle named {}'.format(name)))
+            else:
+                wanted[circle].add(contacts[email].pk)
+        for circle, contact_ids in wanted.items():
+            for batch in batches(contact_ids):
+                contact_ids.difference_update(CircleMember.objects.filter(circle=circle, contact_id__in=batch).values_list('contact_id', flat=True))
+                contact_ids.difference_update(MembershipRequest.objects.filter(circle=circle, requestor_id__in=batch).values_list('requestor_id', flat=True))
+            if not contact_ids:
+                continue
+            MembershipRequest.objects.bulk_create(
+                [MembershipRequest(circle=circle, requestor_id=pk) for pk in contact_ids],
+                batch_size=BATCH_SIZE)
+            self.requested += len(contact_ids)
+            # bulk_create skips the post_save signal, so send one notification for the whole batch
+            transaction.on_commit(lambda circle=circle, ids=list(contact_ids): comm.notify_circle_membership(circle, 'pending member', ids))
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=getattr(settings, 'IMPORT_THREADS', IMPORT_THREADS))
+        return _executor
+
+
+def queue_import(fp, filename='', user=None):
+    """
+    Saves the CSV in `fp` as a new ImportJob, and starts it once the transaction commits
+    """
+    job = ImportJob.objects.create(
+        data=fp.read(),
+        filename=filename,
+        creator=user if user and user.is_authenticated else None)
+    if getattr(settings, 'IMPORT_IN_PROCESS', False):
+        transaction.on_commit(lambda: get_executor().submit(_run_in_thread, job.pk))
+    return job
+
+
+def _run_in_thread(pk):
+    try:
+        run_import(pk)
+    finally:
+        connection.close()
+
+
+def error_report(errors):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(('Row', 'Error'))
+    writer.writerows(errors)
+    return out.getvalue()
+
+
+def run_import(pk):
+    """
+    Runs the queued job `pk`, unless another worker already took it
+    """
+    if not ImportJob.objects.filter(pk=pk, status='queued').update(status='running', started=now()):
+        return
+    job = ImportJob.objects.get(pk=pk)
+    jobs = ImportJob.objects.filter(pk=pk)
+
+    def progress(importer):
+        jobs.update(
+            rows=importer.rows,
+            created_contacts=importer.created,
+            matched_contacts=importer.matched,
+            requested_memberships=importer.requested,
+            error_count=len(importer.errors))
+
+    importer = ContactImporter(progress=progress)
+    status = 'done'
+    message = ''
+    try:
+        importer.run(read_contacts(io.StringIO(job.data)))
+    except Exception as e:
+        status = 'failed'
+        if isinstance(e, ValueError) and not importer.rows:
+            # from read_contacts, before the first row
+            message = 'The CSV file needs an email column'
+        else:
+            logger.exception('Import %d failed', pk)
+            message = 'Stopped at row {}: {}'.format(importer.rows, e)
+    progress(importer)
+    jobs.update(
+        status=status,
+        message=message,
+        finished=now(),
+        data='',
+        error_report=error_report(importer.errors) if importer.errors else '')
+
+
+def run_queued_imports():
+    """
+    Runs every queued job, oldest first. Returns the number of jobs run
+    """
+    num = 0
+    for pk in ImportJob.objects.filter(status='queued').order_by('created').values_list('pk', flat=True):
+        run_import(pk)
+        num += 1
+    return num
+
+
+def requeue_stale_imports(age=STALE_IMPORT_AGE):
+    """
+    Queues jobs that have been running for longer than `age` again. Returns the number of jobs requeued
+    """
+    return ImportJob.objects.filter(status='running', started__lt=now() - age).update(status='queued', started=None)
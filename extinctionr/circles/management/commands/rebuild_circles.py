@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from extinctionr.circles.models import Circle
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the circle paths and membership counts'
+
+    def handle(self, *args, **kwargs):
+        paths = Circle.objects.rebuild_paths()
+        counts = Circle.objects.rebuild_member_counts()
+        self.stdout.write('Fixed %d paths and %d member counts' % (paths, counts))
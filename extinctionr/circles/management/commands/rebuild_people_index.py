@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from extinctionr.circles.models import ContactFacet, ContactSearchTerm
+
+
+class Command(BaseCommand):
+    help = 'Recreates the tag and action index used to find people, and the contact autocomplete terms'
+
+    def handle(self, *args, **kwargs):
+        num = ContactFacet.objects.rebuild()
+        self.stdout.write('Indexed %d tags and attended actions' % num)
+        num = ContactSearchTerm.objects.rebuild()
+        self.stdout.write('Indexed %d contact search terms' % num)
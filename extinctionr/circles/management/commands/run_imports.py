@@ -0,0 +1,31 @@
+import time
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from extinctionr.circles.importer import STALE_IMPORT_AGE, requeue_stale_imports, run_queued_imports
+
+
+class Command(BaseCommand):
+    help = 'Runs queued contact imports. Use --loop to keep running as a worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='keep checking for new imports')
+        parser.add_argument('--interval', type=int, default=10, help='seconds to wait when nothing is queued')
+        parser.add_argument(
+            '--stale', type=int, default=int(STALE_IMPORT_AGE.total_seconds() // 60),
+            help='minutes after which a running import is considered abandoned and queued again')
+
+    def handle(self, *args, **kwargs):
+        stale = timedelta(minutes=kwargs['stale'])
+        while True:
+            requeued = requeue_stale_imports(stale)
+            if requeued:
+                self.stdout.write('requeued %d stale imports' % requeued)
+            num = run_queued_imports()
+            if num:
+                self.stdout.write('ran %d imports' % num)
+            if not kwargs['loop']:
+                break
+            if not num:
+                time.sleep(kwargs['interval'])
@@ -0,0 +1,30 @@
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Circle = apps.get_model('circles', 'Circle')
+    parents = dict(Circle.objects.values_list('id', 'parent_id'))
+    for pk in parents:
+        ids = []
+        current = pk
+        while current is not None and current not in ids:
+            ids.append(current)
+            current = parents.get(current)
+        path = '/%s/' % '/'.join(str(i) for i in reversed(ids))
+        Circle.objects.filter(pk=pk).update(path=path)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0020_signup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='circle',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, help_text='Ids from the top level circle down to this one, like /1/5/12/', max_length=255),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+from collections import defaultdict
+
+from django.db import migrations, models
+
+
+LEAD_ROLES = ('int', 'ext', 'lead')
+
+
+def count_members(apps, schema_editor):
+    Circle = apps.get_model('circles', 'Circle')
+    CircleMember = apps.get_model('circles', 'CircleMember')
+    paths = dict(Circle.objects.values_list('id', 'path'))
+    direct = defaultdict(set)
+    members = defaultdict(set)
+    leads = set()
+    for circle_id, contact_id, role in CircleMember.objects.values_list('circle_id', 'contact_id', 'role'):
+        direct[circle_id].add(contact_id)
+        if role in LEAD_ROLES:
+            leads.add(circle_id)
+        for pk in paths.get(circle_id, '').split('/'):
+            if pk:
+                members[int(pk)].add(contact_id)
+    for pk in paths:
+        Circle.objects.filter(pk=pk).update(
+            member_count=len(direct[pk]),
+            recursive_member_count=len(members[pk]),
+            has_leads=pk in leads)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0021_circle_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='circle',
+            name='member_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Distinct members of this circle'),
+        ),
+        migrations.AddField(
+            model_name='circle',
+            name='recursive_member_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Distinct members of this circle and its subgroups'),
+        ),
+        migrations.AddField(
+            model_name='circle',
+            name='has_leads',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.RunPython(count_members, migrations.RunPython.noop),
+    ]
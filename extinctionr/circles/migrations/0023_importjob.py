@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('circles', '0022_circle_member_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('filename', models.CharField(blank=True, default='', max_length=255)),
+                ('data', models.TextField(blank=True, default='', help_text='The uploaded CSV, emptied once imported')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('rows', models.IntegerField(default=0)),
+                ('created_contacts', models.IntegerField(default=0)),
+                ('matched_contacts', models.IntegerField(default=0)),
+                ('requested_memberships', models.IntegerField(default=0)),
+                ('error_count', models.IntegerField(default=0)),
+                ('error_report', models.TextField(blank=True, default='', help_text='CSV of the rows that could not be imported')),
+                ('message', models.TextField(blank=True, default='')),
+                ('creator', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,87 @@
+import json
+
+from django.db import migrations, models
+
+
+JSON_FIELDS = ('email', 'first_name', 'last_name', 'phone', 'zipcode', 'interests', 'other_groups', 'committment', 'working_group', 'anything_else')
+
+
+def copy_data(apps, schema_editor):
+    Signup = apps.get_model('circles', 'Signup')
+    max_lengths = {key: Signup._meta.get_field(key).max_length for key in JSON_FIELDS}
+    changed = []
+    for signup in Signup.objects.all().iterator():
+        try:
+            data = json.loads(signup.raw_data)
+        except ValueError:
+            continue
+        if not isinstance(data, dict):
+            continue
+        for key in JSON_FIELDS:
+            value = data.get(key)
+            value = '' if value is None else str(value)
+            # free text answers can be longer than the new columns
+            setattr(signup, key, value[:max_lengths[key]] if max_lengths[key] else value)
+        changed.append(signup)
+    Signup.objects.bulk_update(changed, JSON_FIELDS, batch_size=100)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0023_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='signup',
+            name='email',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='first_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='last_name',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='phone',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='zipcode',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='interests',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='other_groups',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='committment',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=50),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='working_group',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=255),
+        ),
+        migrations.AddField(
+            model_name='signup',
+            name='anything_else',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(copy_data, migrations.RunPython.noop),
+    ]
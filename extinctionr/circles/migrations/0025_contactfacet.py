@@ -0,0 +1,46 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_index(apps, schema_editor):
+    ContactFacet = apps.get_model('circles', 'ContactFacet')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    TaggedItem = apps.get_model('taggit', 'TaggedItem')
+    Attendee = apps.get_model('actions', 'Attendee')
+    try:
+        contact_type = ContentType.objects.get(app_label='contacts', model='contact')
+    except ContentType.DoesNotExist:
+        tags = []
+    else:
+        tags = TaggedItem.objects.filter(content_type=contact_type).values_list('tag_id', 'object_id').distinct()
+    attendees = Attendee.objects.values_list('action_id', 'contact_id').distinct()
+    for kind, pairs in (('t', tags), ('a', attendees)):
+        facets = [ContactFacet(kind=kind, value=value, contact_id=pk) for value, pk in pairs]
+        ContactFacet.objects.bulk_create(facets, batch_size=500, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('taggit', '0003_taggeditem_add_unique_index'),
+        ('actions', '0022_commitment_tracking'),
+        ('contacts', '0003_merge_20190214_1427'),
+        ('circles', '0024_signup_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactFacet',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('t', 'Tag'), ('a', 'Attended action')], max_length=1)),
+                ('value', models.IntegerField(help_text='Id of the tag or action')),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contacts.Contact')),
+            ],
+            options={
+                'unique_together': {('kind', 'value', 'contact')},
+            },
+        ),
+        migrations.RunPython(build_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def normalize_term(value):
+    return ' '.join((value or '').lower().split())[:100]
+
+
+def build_terms(apps, schema_editor):
+    Contact = apps.get_model('contacts', 'Contact')
+    ContactSearchTerm = apps.get_model('circles', 'ContactSearchTerm')
+    terms = []
+    for pk, email, first_name, last_name in Contact.objects.values_list('pk', 'email', 'first_name', 'last_name').iterator():
+        names = set(normalize_term(v) for v in (email, first_name, last_name, '{} {}'.format(first_name, last_name)))
+        terms.extend(ContactSearchTerm(contact_id=pk, term=t) for t in names if t and t not in ('?', 'unknown'))
+    ContactSearchTerm.objects.bulk_create(terms, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contacts', '0003_merge_20190214_1427'),
+        ('circles', '0025_contactfacet'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContactSearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=100)),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contacts.Contact')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='contactsearchterm',
+            index=models.Index(fields=['term', 'contact'], name='contact_search_term_idx'),
+        ),
+        migrations.RunPython(build_terms, migrations.RunPython.noop),
+    ]
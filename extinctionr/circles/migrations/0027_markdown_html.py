@@ -0,0 +1,62 @@
+from django.db import migrations, models
+from django.utils.html import strip_tags
+from markdownx.utils import markdownify
+
+
+FIELDS = {
+    'Circle': ('purpose', 'sensitive_info', 'role_description'),
+    'CircleJob': ('job',),
+    'Couch': ('availability', 'info'),
+}
+
+
+def render_html(apps, schema_editor):
+    for model_name, fields in FIELDS.items():
+        model = apps.get_model('circles', model_name)
+        changed = []
+        for obj in model.objects.all():
+            for name in fields:
+                setattr(obj, name + '_html', markdownify(strip_tags(getattr(obj, name))))
+            changed.append(obj)
+        model.objects.bulk_update(changed, [name + '_html' for name in fields], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('circles', '0026_contactsearchterm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='circle',
+            name='purpose_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='circle',
+            name='sensitive_info_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='circle',
+            name='role_description_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='circlejob',
+            name='job_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='couch',
+            name='availability_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.AddField(
+            model_name='couch',
+            name='info_html',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(render_html, migrations.RunPython.noop),
+    ]
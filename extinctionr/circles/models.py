@@ -1,12 +1,17 @@
-from django.core.exceptions import MultipleObjectsReturned
-from django.db import models
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import MultipleObjectsReturned, ValidationError
+from django.core.cache import cache
+from django.db import models, transaction
 from django.urls import reverse
 from contacts.models import Contact
-from extinctionr.utils import get_contact
+from extinctionr.utils import BATCH_SIZE, RenderedMarkdownMixin, batches, bump_generation, get_contact, get_generation, user_contact
 from django.utils.timezone import now
 from django.utils.functional import cached_property
 from markdownx.models import MarkdownxField
+from taggit.models import TaggedItem
 from collections import defaultdict
+from hashlib import md5
 import json
 
 
@@ -19,19 +24,190 @@ ROLE_CHOICES = {
 
 LEAD_ROLES = ('int', 'ext', 'lead')
 
-
-class Circle(models.Model):
+# maintained by the CircleMember signals, see CircleManager.count_membership()
+COUNT_FIELDS = ('member_count', 'recursive_member_count', 'has_leads')
+
+
+def subtree_q(path, field='path'):
+    """
+    Matches the circle at `path` and every circle under it.
+    Uses a range rather than LIKE, so the index on path is used: '0' sorts right after '/'.
+    """
+    return models.Q(**{field + '__gte': path, field + '__lt': path[:-1] + '0'})
+
+
+def get_my_circles(user):
+    """
+    Returns (member_of, leads): the ids of the circles `user` belongs to, directly or through a subgroup,
+    and of the circles they lead. Loaded with one query, then kept on the user for the rest of the request.
+    """
+    try:
+        return user._my_circles
+    except AttributeError:
+        pass
+    member_of = set()
+    leads = set()
+    email = (user.email or '').lower().strip() if user.is_authenticated else ''
+    if email:
+        for circle_id, path, role in CircleMember.objects.filter(contact__email=email).values_list('circle_id', 'circle__path', 'role'):
+            member_of.update(int(pk) for pk in path.split('/') if pk)
+            if role in LEAD_ROLES:
+                leads.add(circle_id)
+    user._my_circles = (member_of, leads)
+    return user._my_circles
+
+
+def build_rollup():
+    """
+    Returns {circle id: {'direct': distinct members of the circle itself, 'count': distinct members
+    in the subtree, 'roles': roles held directly}} for the whole forest, from one query:
+    every membership counts toward the circle's ancestors, found from its materialized path.
+    """
+    paths = dict(Circle.objects.values_list('id', 'path'))
+    direct = defaultdict(set)
+    members = defaultdict(set)
+    roles = defaultdict(set)
+    for circle_id, contact_id, role in CircleMember.objects.values_list('circle_id', 'contact_id', 'role'):
+        direct[circle_id].add(contact_id)
+        roles[circle_id].add(role)
+        for pk in paths.get(circle_id, '').split('/'):
+            if pk:
+                members[int(pk)].add(contact_id)
+    return {pk: {'direct': len(direct[pk]), 'count': len(members[pk]), 'roles': roles[pk]} for pk in paths}
+
+
+def shown_on_circle_pages(contact_ids):
+    """
+    Whether any of `contact_ids` is a circle member or a couch owner. Only those contacts
+    appear on the circle and couch pages, so only their changes need to bump 'circles'
+    """
+    for batch in batches(contact_ids):
+        if CircleMember.objects.filter(contact_id__in=batch).exists() or Couch.objects.filter(owner_id__in=batch).exists():
+            return True
+    return False
+
+
+class CircleManager(models.Manager):
+    def tree(self, root=None):
+        """
+        Loads circles in one query and links their children and ancestors in memory,
+        so the tree can be walked without further queries.
+        Returns the top level circles, or `root` linked to its subtree and ancestors.
+        """
+        qset = self.get_queryset()
+        if root is not None:
+            qset = qset.filter(subtree_q(root.path) | models.Q(pk__in=root.ancestor_ids))
+        circles = [root if root is not None and circle.pk == root.pk else circle for circle in qset]
+        by_id = {circle.pk: circle for circle in circles}
+        for circle in circles:
+            circle.__dict__['children'] = []
+            circle.__dict__['coordinators'] = []
+        coordinators = CircleMember.objects.filter(role__in=LEAD_ROLES).select_related('contact').order_by('role', 'pk')
+        if root is not None:
+            coordinators = coordinators.filter(circle__in=list(by_id))
+        for mem in coordinators:
+            if mem.circle_id in by_id:
+                by_id[mem.circle_id].coordinators.append(mem)
+        top = []
+        for circle in circles:
+            parent = by_id.get(circle.parent_id)
+            if parent is None:
+                top.append(circle)
+            else:
+                circle.parent = parent
+                parent.children.append(circle)
+            circle.__dict__['ancestors'] = [by_id[pk] for pk in circle.ancestor_ids if pk in by_id]
+        return top if root is None else root
+
+    def rebuild_paths(self):
+        """
+        Recomputes every materialized path from the parent links.
+        Returns the number of circles that changed.
+        """
+        circles = list(self.get_queryset().only('id', 'parent_id', 'path'))
+        parents = {circle.pk: circle.parent_id for circle in circles}
+        changed = []
+        for circle in circles:
+            ids = []
+            pk = circle.pk
+            while pk is not None and pk not in ids:
+                ids.append(pk)
+                pk = parents.get(pk)
+            path = '/%s/' % '/'.join(str(pk) for pk in reversed(ids))
+            if circle.path != path:
+                circle.path = path
+                changed.append(circle)
+        self.bulk_update(changed, ['path'])
+        return len(changed)
+
+    def rebuild_member_counts(self):
+        """
+        Recomputes the membership columns of every circle from build_rollup().
+        Returns the number of circles that changed.
+        """
+        rollup = build_rollup()
+        changed = []
+        for circle in self.get_queryset().only('id', *COUNT_FIELDS):
+            row = rollup.get(circle.pk)
+            counts = (row['direct'], row['count'], not row['roles'].isdisjoint(LEAD_ROLES)) if row else (0, 0, False)
+            if counts != (circle.member_count, circle.recursive_member_count, circle.has_leads):
+                circle.member_count, circle.recursive_member_count, circle.has_leads = counts
+                changed.append(circle)
+        self.bulk_update(changed, COUNT_FIELDS)
+        return len(changed)
+
+    def count_membership(self, member, delta):
+        """
+        Adjusts the membership columns after `member` was added (delta=1) or removed (delta=-1).
+        A contact only counts once per circle: member_count is left alone if they hold another
+        membership in the same circle, and recursive_member_count of the circles where they hold
+        another membership, directly or underneath.
+        """
+        path = self.get_queryset().filter(pk=member.circle_id).values_list('path', flat=True).first()
+        if not path:
+            return
+        others = CircleMember.objects.filter(contact_id=member.contact_id).exclude(pk=member.pk).values_list('circle_id', 'circle__path')
+        covered = set()
+        direct = False
+        for circle_id, other_path in others:
+            direct = direct or circle_id == member.circle_id
+            covered.update(other_path.split('/'))
+        chain = [int(pk) for pk in path.split('/') if pk and pk not in covered]
+        if chain:
+            self.get_queryset().filter(pk__in=chain).update(recursive_member_count=models.F('recursive_member_count') + delta)
+        if not direct:
+            self.get_queryset().filter(pk=member.circle_id).update(member_count=models.F('member_count') + delta)
+        if member.role in LEAD_ROLES:
+            self.update_has_leads(member.circle_id)
+
+    def update_has_leads(self, circle_id):
+        has_leads = CircleMember.objects.filter(circle_id=circle_id, role__in=LEAD_ROLES).exists()
+        self.get_queryset().filter(pk=circle_id).update(has_leads=has_leads)
+
+
+class Circle(RenderedMarkdownMixin, models.Model):
     created = models.DateTimeField(db_index=True, auto_now_add=True)
     modified = models.DateTimeField(auto_now=True)
     name = models.CharField(max_length=255, db_index=True)
     purpose = MarkdownxField(default='', help_text='Describe the mandates for this group')
     sensitive_info = MarkdownxField(default='', blank=True, help_text='Information for members only')
+    purpose_html = models.TextField(default='', blank=True, editable=False)
+    sensitive_info_html = models.TextField(default='', blank=True, editable=False)
     members = models.ManyToManyField(to=Contact, through='CircleMember', blank=True)
     parent = models.ForeignKey('self', blank=True, null=True, on_delete=models.SET_NULL)
     color = models.CharField(max_length=50, blank=True, default='')
     email = models.EmailField(max_length=255, blank=True, null=True, help_text='Public email address for this group')
     available_roles = models.CharField(max_length=255, blank=True, default='int,ext,member', help_text='Comma-separated names of roles')
     role_description = MarkdownxField(default='', blank=True, help_text='Describe additional roles (markdown format')
+    role_description_html = models.TextField(default='', blank=True, editable=False)
+    path = models.CharField(max_length=255, db_index=True, default='', editable=False, help_text='Ids from the top level circle down to this one, like /1/5/12/')
+    member_count = models.IntegerField(default=0, editable=False, help_text='Distinct members of this circle')
+    recursive_member_count = models.IntegerField(default=0, editable=False, help_text='Distinct members of this circle and its subgroups')
+    has_leads = models.BooleanField(default=False, editable=False)
+
+    objects = CircleManager()
+
+    markdown_fields = ('purpose', 'sensitive_info', 'role_description')
 
     class Meta:
         ordering = ('name',)
@@ -42,8 +218,41 @@ class Circle(models.Model):
         parents.append(self.name)
         return ' :: '.join(parents)
 
+    def save(self, *args, **kwargs):
+        old_path = ''
+        if self.pk:
+            old_path = Circle.objects.filter(pk=self.pk).values_list('path', flat=True).first() or ''
+            self.path = self._build_path()
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'path'}
+            elif old_path and not kwargs.get('force_insert'):
+                # the membership columns are maintained with F() updates, don't overwrite them with stale values
+                kwargs['update_fields'] = [f.name for f in self._meta.concrete_fields if not f.primary_key and f.name not in COUNT_FIELDS]
+        super().save(*args, **kwargs)
+        if not self.path:
+            self.path = self._build_path()
+            Circle.objects.filter(pk=self.pk).update(path=self.path)
+        if old_path and old_path != self.path:
+            # moved to another parent: everything underneath moves with it
+            descendants = list(Circle.objects.filter(subtree_q(old_path)).exclude(pk=self.pk).only('id', 'path'))
+            for circle in descendants:
+                circle.path = self.path + circle.path[len(old_path):]
+            Circle.objects.bulk_update(descendants, ['path'])
+            Circle.objects.rebuild_member_counts()
+        self.__dict__.pop('ancestors', None)
+        self.__dict__.pop('children', None)
+
+    def _build_path(self):
+        parent_path = None
+        if self.parent_id:
+            parent_path = Circle.objects.filter(pk=self.parent_id).values_list('path', flat=True).first()
+        return '%s%d/' % (parent_path or '/', self.pk)
+
     def clean(self):
         super().clean()
+        if self.parent_id and self.pk:
+            if self.parent_id == self.pk or self.pk in self.parent.ancestor_ids:
+                raise ValidationError({'parent': 'A circle cannot be inside itself'})
         available = [a.strip() for a in self.available_roles.split(',') if a.strip()]
         # for role in ROLE_CHOICES.keys():
         #     if role not in available:
@@ -64,17 +273,11 @@ class Circle(models.Model):
     @cached_property
     def recursive_members(self):
         members = defaultdict(set)
-        for mem in CircleMember.objects.filter(circle=self).select_related('contact').order_by('role', 'pk'):
+        qset = CircleMember.objects.filter(subtree_q(self.path, 'circle__path')).select_related('contact').order_by('role', 'pk')
+        for mem in qset:
             members[mem.contact].add((mem.role, mem.verbose_role, mem.id, mem.circle_id))
-        for circle in self.children:
-            for contact, roles in circle.recursive_members.items():
-                members[contact].update(roles)
         return members
 
-    @cached_property
-    def recursive_members_count(self):
-        return len(self.recursive_members)
-
     @cached_property
     def children(self):
         return list(self.circle_set.all().prefetch_related('members'))
@@ -93,15 +296,15 @@ class Circle(models.Model):
 
     @cached_property
     def coordinators(self):
-        return CircleMember.objects.filter(circle=self, role__in=LEAD_ROLES).order_by('role', 'pk')
+        return list(CircleMember.objects.filter(circle=self, role__in=LEAD_ROLES).select_related('contact').order_by('role', 'pk'))
 
     @property
     def external_coordinators(self):
-        return self.coordinators.filter(role='ext')
+        return [mem for mem in self.coordinators if mem.role == 'ext']
 
     @property
     def internal_coordinators(self):
-        return self.coordinators.filter(role__in=('int', 'lead'))
+        return [mem for mem in self.coordinators if mem.role in ('int', 'lead')]
 
     def get_absolute_url(self):
         return reverse('circles:detail', kwargs={'pk': self.id})
@@ -114,27 +317,45 @@ class Circle(models.Model):
         path += '/index.yaml'
         return path.encode('utf8')
 
+    @property
+    def ancestor_ids(self):
+        """
+        Ids of the parent circles, nearest first
+        """
+        ids = [int(pk) for pk in self.path.split('/') if pk]
+        return ids[-2::-1]
+
+    @cached_property
+    def ancestors(self):
+        if not self.path:
+            # not saved yet
+            ancestors = []
+            parent = self.parent
+            while parent is not None:
+                ancestors.append(parent)
+                parent = parent.parent
+            return ancestors
+        ids = self.ancestor_ids
+        circles = Circle.objects.in_bulk(ids) if ids else {}
+        return [circles[pk] for pk in ids if pk in circles]
+
     @property
     def parents(self):
-        parent = self.parent
-        while parent is not None:
-            yield parent
-            parent = parent.parent
+        return iter(self.ancestors)
 
     @property
     def bgcolor(self):
-        return self.color or (self.parent.bgcolor if self.parent else '')
+        return next((c.color for c in [self] + self.ancestors if c.color), '')
 
     @property
     def has_children(self):
+        if 'children' in self.__dict__:
+            return bool(self.children)
         return self.circle_set.exists()
-    
+
     @cached_property
     def public_email(self):
-        email = self.email
-        if not email:
-            email = self.parent.public_email if self.parent else ''
-        return email
+        return next((c.email for c in [self] + self.ancestors if c.email), '')
 
     def get_notification_addresses(self):
         addresses = set()
@@ -177,20 +398,13 @@ class Circle(models.Model):
             req.save()
 
     def can_manage(self, user):
-        return user.has_perm('circles.change_circle') or self.leads.filter(pk=get_contact(email=user.email).id).exists()
+        return user.has_perm('circles.change_circle') or self.pk in get_my_circles(user)[1]
 
     def is_member(self, user):
-        email = user.email
-        for member in self.recursive_members:
-            if member.email == email:
-                return True
-        return False
+        return self.pk in get_my_circles(user)[0]
 
     def is_pending(self, request):
-        if request.user.is_authenticated:
-            contact = get_contact(request.user.email)
-        else:
-            contact = None
+        contact = user_contact(request.user)
         if contact:
             try:
                 return MembershipRequest.objects.get(circle=self, requestor=contact).confirm_date is None
@@ -246,16 +460,19 @@ class MembershipRequest(models.Model):
             self.circle.remove_member(self.requestor, role='member')
 
 
-class CircleJob(models.Model):
+class CircleJob(RenderedMarkdownMixin, models.Model):
     created = models.DateTimeField(db_index=True, auto_now_add=True)
     circle = models.ForeignKey(Circle, on_delete=models.CASCADE)
     creator = models.ForeignKey(Contact, null=True, blank=True, on_delete=models.SET_NULL)
     job = MarkdownxField(default='')
+    job_html = models.TextField(default='', blank=True, editable=False)
     filled = models.ForeignKey(Contact, null=True, blank=True, on_delete=models.SET_NULL, related_name="my_job_set", help_text="Who will fill this job?")
     filled_on = models.DateTimeField(null=True, blank=True)
     asap = models.BooleanField(blank=True, default=False, help_text="This job needs to be filled as soon as possible")
     title = models.CharField(max_length=255, blank=True, default='')
 
+    markdown_fields = ('job', )
+
     def get_absolute_url(self):
         return '{}jobs/{}'.format(self.circle.get_absolute_url(), self.id)
 
@@ -263,14 +480,18 @@ class CircleJob(models.Model):
         return 'Job for {}'.format(self.circle)
 
 
-class Couch(models.Model):
+class Couch(RenderedMarkdownMixin, models.Model):
     created = models.DateTimeField(db_index=True, auto_now_add=True)
     modified = models.DateTimeField(db_index=True, auto_now=True)
     owner = models.ForeignKey(Contact, on_delete=models.CASCADE)
     availability = MarkdownxField(default='', help_text="Enter dates/times this room is available")
     info = MarkdownxField(default='')
+    availability_html = models.TextField(default='', blank=True, editable=False)
+    info_html = models.TextField(default='', blank=True, editable=False)
     public = models.BooleanField(default=False, db_index=True, help_text="Show publicly")
 
+    markdown_fields = ('availability', 'info')
+
     class Meta:
         verbose_name_plural = 'couches'
 
@@ -281,7 +502,7 @@ class Couch(models.Model):
         return reverse('circles:person', kwargs={'contact_id': self.owner_id}) + '#couches'
 
     def is_me(self, user):
-        return get_contact(user.email) == self.owner
+        return user_contact(user) == self.owner
 
 
 class Signup(models.Model):
@@ -289,19 +510,217 @@ class Signup(models.Model):
     contact = models.ForeignKey(Contact, null=True, blank=True, on_delete=models.SET_NULL)
     ip_address = models.CharField(max_length=255, blank=True, default='')
     raw_data = models.TextField(blank=True, default='{}')
-
+    email = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    first_name = models.CharField(max_length=255, blank=True, default='')
+    last_name = models.CharField(max_length=255, blank=True, default='')
+    phone = models.CharField(max_length=50, blank=True, default='')
+    zipcode = models.CharField(max_length=20, blank=True, default='', db_index=True)
+    interests = models.TextField(blank=True, default='')
+    other_groups = models.TextField(blank=True, default='')
+    committment = models.CharField(max_length=50, blank=True, default='', db_index=True)
+    working_group = models.CharField(max_length=255, blank=True, default='', db_index=True)
+    anything_else = models.TextField(blank=True, default='')
+
+    # the form fields that are copied from raw_data into their own columns
     json_fields = ('email', 'first_name', 'last_name', 'phone', 'zipcode', 'interests', 'other_groups', 'committment', 'working_group', 'anything_else')
 
+    def __str__(self):
+        return 'Signup from {}'.format(self.contact or self.email)
+
     @property
     def data(self):
-        return json.loads(self.raw_data)
+        if getattr(self, '_data_source', None) != self.raw_data:
+            self._data = json.loads(self.raw_data)
+            self._data_source = self.raw_data
+        return self._data
 
     @data.setter
     def data(self, obj):
         self.raw_data = json.dumps(obj)
+        for key in self.json_fields:
+            value = obj.get(key)
+            value = '' if value is None else str(value)
+            max_length = self._meta.get_field(key).max_length
+            setattr(self, key, value[:max_length] if max_length else value)
+
+
+# CSV contact imports, run in the background by extinctionr.circles.importer
+class ImportJob(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    created = models.DateTimeField(db_index=True, auto_now_add=True)
+    creator = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    filename = models.CharField(max_length=255, blank=True, default='')
+    data = models.TextField(blank=True, default='', help_text='The uploaded CSV, emptied once imported')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued', db_index=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    rows = models.IntegerField(default=0)
+    created_contacts = models.IntegerField(default=0)
+    matched_contacts = models.IntegerField(default=0)
+    requested_memberships = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    error_report = models.TextField(blank=True, default='', help_text='CSV of the rows that could not be imported')
+    message = models.TextField(blank=True, default='')
 
+    def __str__(self):
+        return 'Import of {} ({})'.format(self.filename or self.id, self.get_status_display())
+
+    def get_absolute_url(self):
+        return reverse('circles:import-job', kwargs={'pk': self.id})
+
+    @property
+    def is_finished(self):
+        return self.status in ('done', 'failed')
+
+    @property
+    def progress(self):
+        return {
+            'status': self.status,
+            'rows': self.rows,
+            'created': self.created_contacts,
+            'matched': self.matched_contacts,
+            'requested': self.requested_memberships,
+            'errors': self.error_count,
+            'message': self.message,
+        }
+
+
+class ContactFacetManager(models.Manager):
+    def add(self, kind, value, contact_ids):
+        self.bulk_create(
+            [ContactFacet(kind=kind, value=value, contact_id=pk) for pk in set(contact_ids)],
+            batch_size=BATCH_SIZE,
+            ignore_conflicts=True)
+
+    def remove(self, kind, value, contact_ids):
+        for batch in batches(set(contact_ids)):
+            self.filter(kind=kind, value=value, contact_id__in=batch).delete()
+
+    def matching(self, tag_ids=(), action_ids=(), match_all=False):
+        """
+        Returns a values queryset of the ids of contacts with the tags and who attended the actions:
+        any of each, or all of them with `match_all`. None if nothing was asked for.
+        """
+        ids = None
+        for kind, values in ((ContactFacet.TAG, set(tag_ids)), (ContactFacet.ACTION, set(action_ids))):
+            if not values:
+                continue
+            qset = self.filter(kind=kind, value__in=values)
+            if ids is not None:
+                qset = qset.filter(contact_id__in=ids)
+            qset = qset.values('contact_id')
+            if match_all and len(values) > 1:
+                qset = qset.annotate(num=models.Count('value')).filter(num=len(values)).values('contact_id')
+            else:
+                qset = qset.distinct()
+            ids = qset
+        return ids
+
+    def rebuild(self):
+        """
+        Recreates the whole index from the tags and attendees. Returns the number of entries
+        """
+        from extinctionr.actions.models import Attendee
+        contact_type = ContentType.objects.get_for_model(Contact)
+        tags = TaggedItem.objects.filter(content_type=contact_type).values_list('tag_id', 'object_id').distinct()
+        attendees = Attendee.objects.values_list('action_id', 'contact_id').distinct()
+        with transaction.atomic():
+            self.all().delete()
+            for kind, pairs in ((ContactFacet.TAG, tags), (ContactFacet.ACTION, attendees)):
+                facets = (ContactFacet(kind=kind, value=value, contact_id=pk) for value, pk in pairs.iterator())
+                self.bulk_create(facets, batch_size=BATCH_SIZE, ignore_conflicts=True)
+        return self.count()
+
+
+# Index of contacts by tag and attended action for the people finder, maintained by signals
+class ContactFacet(models.Model):
+    TAG = 't'
+    ACTION = 'a'
+    KIND_CHOICES = (
+        (TAG, 'Tag'),
+        (ACTION, 'Attended action'),
+    )
+    contact = models.ForeignKey(Contact, on_delete=models.CASCADE)
+    kind = models.CharField(max_length=1, choices=KIND_CHOICES)
+    value = models.IntegerField(help_text='Id of the tag or action')
+
+    objects = ContactFacetManager()
+
+    class Meta:
+        unique_together = ('kind', 'value', 'contact')
+
+
+AUTOCOMPLETE_LIMIT = 20
+AUTOCOMPLETE_TIMEOUT = 60
+SEARCH_TERM_LENGTH = 100
 
-    for key in json_fields:
-        exec ('def {0}(self):\n    return self.data.get("{0}", None)'.format(key))
 
-    
+def normalize_term(value):
+    return ' '.join((value or '').lower().split())[:SEARCH_TERM_LENGTH]
+
+
+class ContactSearchTermManager(models.Manager):
+    def terms_for(self, contact):
+        names = [normalize_term(contact.email), normalize_term(contact.first_name), normalize_term(contact.last_name)]
+        names.append(normalize_term('{} {}'.format(contact.first_name, contact.last_name)))
+        return set(t for t in names if t and t not in ('?', 'unknown'))
+
+    def index(self, contacts):
+        """
+        Replaces the search terms of `contacts`, which must have been saved
+        """
+        contacts = [c for c in contacts if c.pk]
+        with transaction.atomic():
+            for batch in batches([c.pk for c in contacts]):
+                self.filter(contact_id__in=batch).delete()
+            self.bulk_create(
+                [ContactSearchTerm(contact_id=c.pk, term=term) for c in contacts for term in self.terms_for(c)],
+                batch_size=BATCH_SIZE)
+        bump_generation('contacts')
+
+    def search(self, q, limit=AUTOCOMPLETE_LIMIT):
+        """
+        Returns the ids of up to `limit` contacts with an email or name starting with `q`.
+        Results are cached for a short while, and until any contact changes.
+        """
+        prefix = normalize_term(q)
+        if not prefix:
+            return []
+        key = 'circles:autocomplete:%s:%d:%s' % (get_generation('contacts'), limit, md5(prefix.encode('utf8')).hexdigest())
+        ids = cache.get(key)
+        if ids is None:
+            # a range on the lowercased terms can use the index, unlike istartswith
+            terms = self.filter(term__gte=prefix, term__lt=prefix + '\uffff')
+            ids = list(terms.values_list('contact_id', flat=True).distinct()[:limit])
+            cache.set(key, ids, AUTOCOMPLETE_TIMEOUT)
+        return ids
+
+    def rebuild(self):
+        """
+        Recreates the search terms of every contact. Returns the number of terms
+        """
+        with transaction.atomic():
+            self.all().delete()
+            contacts = Contact.objects.only('pk', 'email', 'first_name', 'last_name').iterator()
+            terms = (ContactSearchTerm(contact_id=c.pk, term=term) for c in contacts for term in self.terms_for(c))
+            self.bulk_create(terms, batch_size=BATCH_SIZE)
+        bump_generation('contacts')
+        return self.count()
+
+
+# Lowercased emails and names of contacts, for prefix searches in the contact autocomplete
+class ContactSearchTerm(models.Model):
+    contact = models.ForeignKey(Contact, on_delete=models.CASCADE)
+    term = models.CharField(max_length=SEARCH_TERM_LENGTH)
+
+    objects = ContactSearchTermManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'contact'], name='contact_search_term_idx'),
+        ]
@@ -1,11 +1,15 @@
 import os.path
-from django.db.models.signals import m2m_changed, post_save
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
 from django.conf import settings
 
 from django.dispatch import receiver
 from crum import get_current_user
+from django.contrib.contenttypes.models import ContentType
+from taggit.models import TaggedItem
 
-from .models import Circle, CircleMember, MembershipRequest, CircleJob, Signup
+from extinctionr.actions.models import Attendee
+from .models import LEAD_ROLES, Circle, CircleMember, ContactFacet, ContactSearchTerm, Contact, Couch, MembershipRequest, CircleJob, Signup, shown_on_circle_pages
+from extinctionr.utils import bump_generation, contact_cache
 from . import comm, git, get_circle
 
 
@@ -29,6 +33,42 @@ def save_to_git(sender, instance, **kwargs):
         git.commit_circles_to_git(repo_dir, committer)
 
 
+@receiver(post_delete, sender=Circle)
+def reparent_children(sender, instance, **kwargs):
+    # the children were moved to the top level by SET_NULL, without saving them
+    Circle.objects.rebuild_paths()
+    Circle.objects.rebuild_member_counts()
+
+
+@receiver(pre_save, sender=CircleMember)
+def remember_membership(sender, instance, **kwargs):
+    """
+    Keeps the circle, contact and role of an existing membership from before the save, for count_new_member
+    """
+    instance._old_membership = None
+    if not instance._state.adding:
+        instance._old_membership = CircleMember.objects.filter(pk=instance.pk).values_list('circle_id', 'contact_id', 'role').first()
+
+
+@receiver(post_save, sender=CircleMember)
+def count_new_member(sender, instance, created, **kwargs):
+    old = getattr(instance, '_old_membership', None)
+    if created or old is None:
+        Circle.objects.count_membership(instance, 1)
+        return
+    circle_id, contact_id, role = old
+    if (circle_id, contact_id) != (instance.circle_id, instance.contact_id):
+        Circle.objects.count_membership(CircleMember(pk=instance.pk, circle_id=circle_id, contact_id=contact_id, role=role), -1)
+        Circle.objects.count_membership(instance, 1)
+    elif (role in LEAD_ROLES) != (instance.role in LEAD_ROLES):
+        Circle.objects.update_has_leads(instance.circle_id)
+
+
+@receiver(post_delete, sender=CircleMember)
+def count_removed_member(sender, instance, **kwargs):
+    Circle.objects.count_membership(instance, -1)
+
+
 @receiver(post_save, sender=CircleJob)
 def notify_job(sender, instance, **kwargs):
     if instance.filled:
@@ -41,3 +81,70 @@ def send_signup_email(sender, instance, **kwargs):
     if outreach_circle:
         comm.notify_new_signup(outreach_circle, instance)
 
+
+# keep the people finder's index up to date.
+# bulk operations (tag_contacts, Action.bulk_signup) update it themselves
+
+@receiver(post_save, sender=TaggedItem)
+def index_tag(sender, instance, created, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Contact).id:
+        ContactFacet.objects.add(ContactFacet.TAG, instance.tag_id, [instance.object_id])
+
+
+@receiver(post_delete, sender=TaggedItem)
+def unindex_tag(sender, instance, **kwargs):
+    if instance.content_type_id == ContentType.objects.get_for_model(Contact).id:
+        ContactFacet.objects.remove(ContactFacet.TAG, instance.tag_id, [instance.object_id])
+
+
+@receiver(post_save, sender=Attendee)
+def index_attendee(sender, instance, **kwargs):
+    ContactFacet.objects.add(ContactFacet.ACTION, instance.action_id, [instance.contact_id])
+
+
+@receiver(post_delete, sender=Attendee)
+def unindex_attendee(sender, instance, **kwargs):
+    # the contact may have signed up more than once, in different roles
+    if not Attendee.objects.filter(action_id=instance.action_id, contact_id=instance.contact_id).exists():
+        ContactFacet.objects.remove(ContactFacet.ACTION, instance.action_id, [instance.contact_id])
+
+
+@receiver(post_save, sender=Circle)
+@receiver(post_delete, sender=Circle)
+@receiver(post_save, sender=CircleMember)
+@receiver(post_delete, sender=CircleMember)
+@receiver(post_save, sender=MembershipRequest)
+@receiver(post_delete, sender=MembershipRequest)
+@receiver(post_save, sender=CircleJob)
+@receiver(post_delete, sender=CircleJob)
+@receiver(post_save, sender=Couch)
+@receiver(post_delete, sender=Couch)
+def invalidate_circles(sender, instance, **kwargs):
+    # circle pages show member counts and leads, and to members, requests and jobs.
+    # the couch page is cached on the same generation
+    bump_generation('circles')
+
+
+@receiver(post_save, sender=Contact)
+def invalidate_circle_contact(sender, instance, **kwargs):
+    # most contacts, like new signups, aren't on any circle or couch page.
+    # deleting a contact deletes its memberships and couches, which bump 'circles' themselves
+    if shown_on_circle_pages([instance.pk]):
+        bump_generation('circles')
+
+
+@receiver(post_save, sender=Contact)
+@receiver(post_delete, sender=Contact)
+def forget_contact(sender, instance, **kwargs):
+    contact_cache.discard(instance)
+
+
+@receiver(post_save, sender=Contact)
+def index_contact(sender, instance, **kwargs):
+    ContactSearchTerm.objects.index([instance])
+
+
+@receiver(post_delete, sender=Contact)
+def unindex_contact(sender, instance, **kwargs):
+    # the terms go with the contact, but cached searches may still list it
+    bump_generation('contacts')
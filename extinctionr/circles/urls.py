@@ -11,6 +11,9 @@ urlpatterns = [
     path('person/<int:contact_id>/', person_view, name='person'),
     path('person/me/', person_view, name='person-me'),
     path('person/import/', views.csv_import, name='person-import'),
+    path('person/import/<int:pk>/', views.import_job, name='import-job'),
+    path('person/import/<int:pk>/status/', views.import_status, name='import-status'),
+    path('person/import/<int:pk>/errors/', views.import_errors, name='import-errors'),
     path('person/export/', views.csv_export, name='person-export'),
     path('person/autocomplete/', views.ContactAutocomplete.as_view(), name='person-autocomplete'),
     path('person/find/', views.FindFormView.as_view(), name='find-person'),
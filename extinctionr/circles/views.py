@@ -1,18 +1,20 @@
 from io import TextIOWrapper
-import csv
+from urllib.parse import urlencode
 
+from django.core.paginator import Paginator
 from django.shortcuts import render, get_object_or_404, redirect
-from django.contrib.auth.decorators import login_required
+from django.contrib.auth.decorators import login_required, permission_required
 from django.utils.decorators import method_decorator
-from django.views.decorators.cache import cache_page
 from django.views.generic.edit import FormView
 from django.utils.timezone import now
 from django.contrib import messages
-from django.http import HttpResponseForbidden, HttpResponse, HttpResponseRedirect
+from django.http import HttpResponseForbidden, HttpResponse, HttpResponseRedirect, JsonResponse
 from django import forms
 from django.views import generic
-from extinctionr.utils import get_contact, get_last_contact, set_last_contact
-from .models import Circle, Contact, CircleJob, Couch, LEAD_ROLES, Signup
+from django.db.models import Max
+from extinctionr.utils import BATCH_SIZE, get_contact, get_last_contact, iter_chunks, page_cache, page_condition, set_last_contact, stream_csv, user_contact
+from .importer import queue_import
+from .models import Circle, Contact, ContactFacet, CircleJob, Couch, ImportJob, LEAD_ROLES, Signup
 from . import get_circle
 
 from .forms import FindPeopleForm, MembershipRequestForm, ContactForm, CouchForm, ContactAutocomplete, IntakeForm
@@ -36,7 +38,7 @@ def add_member(request, pk):
 def del_member(request, pk):
     circle = get_object_or_404(Circle, pk=pk)
     contact = get_object_or_404(Contact, pk=request.POST['id'])
-    me = get_contact(email=request.user.email)
+    me = user_contact(request.user)
     if me == contact or circle.can_manage(request.user):
         role = request.POST.get('role', 'member')
         circle.remove_member(contact, role=role, who=request.user)
@@ -47,7 +49,7 @@ def approve_membership(request, pk):
     circle = get_object_or_404(Circle, pk=pk)
     contact = get_object_or_404(Contact, pk=request.POST['id'])
     if circle.can_manage(request.user):
-        circle.approve_membership(contact, who=get_contact(email=request.user.email))
+        circle.approve_membership(contact, who=user_contact(request.user, create=True))
         messages.success(request, "Approved {}!".format(contact))
 
     return redirect(circle.get_absolute_url())
@@ -69,67 +71,51 @@ def request_membership(request, pk):
     return redirect(circle.get_absolute_url())
 
 
-def find_field(fields, search_for):
-    for field in fields:
-        if field.lower().startswith(search_for):
-            return field
-    raise ValueError(search_for)
-
-
 @login_required
 def csv_import(request):
     ctx = {}
     can_import = request.user.has_perm('circles.change_circle')
     ctx['can_import'] = can_import
     if can_import and request.method == 'POST':
-        f = TextIOWrapper(request.FILES['csv'].file, encoding=request.encoding)
-        reader = csv.DictReader(f)
-        fields = reader.fieldnames
-        email_field = find_field(fields, 'email')
-        first_name_field = find_field(fields, ('first', 'first name', 'fname'))
-        last_name_field = find_field(fields, ('last', 'last name', 'lname'))
+        upload = request.FILES['csv']
         try:
-            wg_field = find_field(fields, ('circle', 'working group', 'wg'))
-        except ValueError:
-            wg_field = None
+            job = queue_import(TextIOWrapper(upload.file, encoding=request.encoding or 'utf8'), filename=upload.name, user=request.user)
+        except UnicodeDecodeError:
+            messages.error(request, 'Could not read {}. Is it a CSV file?'.format(upload.name))
+            return redirect('circles:person-import')
+        return redirect(job)
+    if can_import:
+        ctx['jobs'] = ImportJob.objects.defer('data', 'error_report').order_by('-created')[:10]
+    response = render(request, 'circles/csv.html', ctx)
+    response['Cache-Control'] = 'private'
+    return response
 
-        try:
-            phone_field = find_field(fields, ('phone number', 'phone'))
-        except ValueError:
-            phone_field = None
 
-        try:
-            tag_field = find_field(fields, ('tags', 'tag'))
-        except ValueError:
-            tag_field = None
-
-        contacts = set()
-        memberships = []
-        for row in reader:
-            contact = get_contact(row[email_field],
-                first_name=row[first_name_field],
-                last_name=row[last_name_field],
-                phone=row[phone_field] if phone_field else None)
-            contacts.add(contact)
-            messages.success(request, 'Found {}'.format(contact))
-            if wg_field and row[wg_field]:
-                wg = row[wg_field].split('-')[0].strip()
-                try:
-                    circle = Circle.objects.filter(name__iexact=wg).order_by('-pk')[0]
-                except IndexError:
-                    messages.error(request, 'Could not find circle named {}'.format(wg))
-                else:
-                    if circle.request_membership(contact=contact):
-                        messages.success(request, 'Requested membership for {} to {}'.format(contact, circle))
-            if tag_field and row[tag_field]:
-                contact.tags.add(*[t.strip() for t in row[tag_field].split(',')])
-        return redirect('circles:person-import')
-    response = render(request, 'circles/csv.html', ctx)
+@permission_required('circles.change_circle')
+def import_job(request, pk):
+    job = get_object_or_404(ImportJob.objects.defer('data'), pk=pk)
+    response = render(request, 'circles/import_job.html', {'job': job})
     response['Cache-Control'] = 'private'
     return response
 
 
-@method_decorator(cache_page(1200), name='dispatch')
+@permission_required('circles.change_circle')
+def import_status(request, pk):
+    job = get_object_or_404(ImportJob.objects.defer('data', 'error_report'), pk=pk)
+    response = JsonResponse(job.progress)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@permission_required('circles.change_circle')
+def import_errors(request, pk):
+    job = get_object_or_404(ImportJob.objects.defer('data'), pk=pk)
+    resp = HttpResponse(job.error_report, content_type='text/csv')
+    resp['Content-Disposition'] = 'attachment; filename="import-{}-errors.csv"'.format(job.id)
+    return resp
+
+
+@method_decorator(page_cache('circles'), name='dispatch')
 class BaseCircleView(generic.View):
     def render_to_response(self, context, **response_kwargs):
         response = super().render_to_response(context, **response_kwargs)
@@ -148,14 +134,14 @@ class PersonView(BaseCircleView, FormView):
         info = form.cleaned_data['info']
         availability = form.cleaned_data['availability']
         public = form.cleaned_data['public']
-        me = get_contact(email=self.request.user.email)
+        me = user_contact(self.request.user, create=True)
         me.couch_set.create(info=info, availability=availability, public=public)
         messages.success(self.request, "Thank you for your generosity!")
         return HttpResponseRedirect('/circle/person/me/')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        me = get_contact(email=self.request.user.email)
+        me = user_contact(self.request.user, create=True)
         contact_id = self.kwargs.get('contact_id', None)
         if contact_id is None:
             contact = me
@@ -234,10 +220,25 @@ class CouchListView(BaseCircleView, generic.ListView):
         return context
 
 
+def circle_state(request, pk):
+    """
+    Validators for CircleView. A page shows its parents and subcircles too, so any change to the tree counts.
+    Removing a member leaves no timestamp behind, so there's no Last-Modified: the ETag covers
+    the 'circles' generation, which every change to members, requests and jobs bumps
+    """
+    modified = Circle.objects.aggregate(modified=Max('modified'))['modified']
+    if modified is None:
+        return None
+    return None, (modified, )
+
+
+@method_decorator(page_condition(circle_state, 'circles'), name='dispatch')
 class CircleView(BaseCircleView, generic.DetailView):
     template_name = 'circles/circle.html'
-    def get_queryset(self):
-        return Circle.objects.select_related('parent').prefetch_related('members')
+    model = Circle
+
+    def get_object(self, queryset=None):
+        return Circle.objects.tree(root=super().get_object(queryset))
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -274,7 +275,7 @@ class TopLevelView(BaseCircleView, generic.ListView):
     template_name = 'circles/outer.html'
 
     def get_queryset(self):
-        return Circle.objects.filter(parent__isnull=True).prefetch_related('members')
+        return Circle.objects.tree()
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -288,7 +289,7 @@ class JobView(BaseCircleView, generic.TemplateView):
 
     def post(self, request, *args, **kwargs):
         job = get_object_or_404(CircleJob, pk=request.POST['id'])
-        who = get_contact(email=self.request.user.email)
+        who = user_contact(self.request.user, create=True)
         job.filled = who
         job.filled_on = now()
         job.save()
@@ -315,30 +316,56 @@ class JobView(BaseCircleView, generic.TemplateView):
         return context
 
 
+def find_contacts(data):
+    """
+    Returns the contacts matching the cleaned data of a FindPeopleForm, from the ContactFacet index,
+    or None if no tags or actions were given
+    """
+    ids = ContactFacet.objects.matching(
+        tag_ids=[tag.id for tag in data['tags']],
+        action_ids=[action.id for action in data['actions']],
+        match_all=data.get('match') == 'all')
+    if ids is None:
+        return None
+    return Contact.objects.filter(pk__in=ids).select_related('address').prefetch_related('tags').order_by('last_name', 'first_name', 'pk')
+
+
 @method_decorator(login_required, name='dispatch')
 class FindFormView(FormView):
     template_name = 'circles/find.html'
     form_class = FindPeopleForm
+    paginate_by = 100
+
+    def get_form_kwargs(self):
+        kwargs = super().get_form_kwargs()
+        if self.request.method == 'GET' and ('tags' in self.request.GET or 'actions' in self.request.GET):
+            kwargs['data'] = self.request.GET
+        return kwargs
+
+    def get(self, request, *args, **kwargs):
+        form = self.get_form()
+        if form.is_bound:
+            return self.form_valid(form) if form.is_valid() else self.form_invalid(form)
+        return super().get(request, *args, **kwargs)
 
     def form_valid(self, form):
-        tags = form.cleaned_data['tags']
-        actions = form.cleaned_data['actions']
-        contacts = Contact.objects
-        if tags:
-            contacts = contacts.filter(tags__in=tags)
-        if actions:
-            contacts = contacts.filter(attendee__action__in=actions)
-
-        if not (actions or tags):
-            contacts = []
-        else:
-            contacts = contacts.distinct()
+        data = form.cleaned_data
         ctx = {
-            'form': FindPeopleForm(initial=form.cleaned_data),
-            'tags': tags,
-            'actions': actions,
-            'contacts': contacts,
+            'form': form,
+            'tags': data['tags'],
+            'actions': data['actions'],
         }
+        contacts = find_contacts(data)
+        if contacts is not None:
+            paginator = Paginator(contacts, self.paginate_by)
+            page = paginator.get_page(self.request.GET.get('page'))
+            ctx['page'] = page
+            ctx['contacts'] = page.object_list
+            ctx['count'] = paginator.count
+            ctx['query'] = urlencode(
+                [('tags', tag.id) for tag in data['tags']] +
+                [('actions', action.id) for action in data['actions']] +
+                [('match', data.get('match') or 'any')])
         response = render(self.request, self.template_name, ctx)
         response['Cache-Control'] = 'private'
         return response
@@ -346,44 +373,37 @@ class FindFormView(FormView):
 
 @login_required
 def csv_export(request):
+    contacts = Contact.objects.none()
     if request.user.has_perm('contacts.view_contact'):
-        contact_ids = [c for c in request.GET.get('contacts', '').split(',') if c]
-        contacts = Contact.objects.filter(id__in=contact_ids)
-    else:
-        contacts = []
-    resp = HttpResponse(content_type='text/csv')
-    resp['Content-Disposition'] = 'attachment; filename="contacts.csv"'
-    csv_writer = csv.writer(resp)
+        if 'contacts' in request.GET:
+            contact_ids = [c for c in request.GET['contacts'].split(',') if c]
+            contacts = Contact.objects.filter(id__in=contact_ids).select_related('address').prefetch_related('tags').order_by('pk')
+        else:
+            form = FindPeopleForm(request.GET)
+            if form.is_valid():
+                # an empty result is still a result; None means no tags or actions were given
+                found = find_contacts(form.cleaned_data)
+                if found is not None:
+                    contacts = found
     header = ('Email', 'First Name', 'Last Name', 'Phone', 'City', 'Tags')
-    csv_writer.writerow(header)
-    for contact in contacts:
-        csv_writer.writerow((
-            contact.email,
-            contact.first_name,
-            contact.last_name,
-            contact.phone,
-            contact.address.city if contact.address else None,
-            ','.join(contact.tags.names())))
-    return resp
+    rows = ((
+        contact.email,
+        contact.first_name,
+        contact.last_name,
+        contact.phone,
+        contact.address.city if contact.address else None,
+        ','.join(tag.name for tag in contact.tags.all())) for contact in iter_chunks(contacts))
+    return stream_csv(rows, filename='contacts.csv', header=header)
 
 
 @login_required
 def signup_export(request):
-    if request.user.has_perm('circles.view_signup'):
-        resp = HttpResponse(content_type='text/csv')
-        resp['Content-Disposition'] = 'attachment; filename="signups.csv"'
-        csv_writer = csv.writer(resp)
-        header = ['Date', 'IP Address', 'Contact ID']
-        wrote_header = False
-        for signup in Signup.objects.all():
-            data = signup.data
-            row = [signup.created, signup.ip_address, signup.contact_id]
-            if not wrote_header:
-                header.extend(sorted(data))
-                csv_writer.writerow(header)
-                wrote_header = True
-            for key, value in sorted(data.items()):
-                row.append(value)
-            csv_writer.writerow(row)
-        return resp
-
+    if not request.user.has_perm('circles.view_signup'):
+        return HttpResponseForbidden()
+    signups = Signup.objects.order_by('pk')
+    for key in ('working_group', 'zipcode', 'committment'):
+        if request.GET.get(key):
+            signups = signups.filter(**{key: request.GET[key]})
+    header = ('Date', 'IP Address', 'Contact ID') + Signup.json_fields
+    rows = signups.values_list('created', 'ip_address', 'contact_id', *Signup.json_fields)
+    return stream_csv(rows.iterator(chunk_size=BATCH_SIZE), filename='signups.csv', header=header)
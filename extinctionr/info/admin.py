@@ -1,7 +1,7 @@
 from django.contrib import admin
 from markdownx.admin import MarkdownxModelAdmin
 
-from .models import Photo, PressRelease, Chapter
+from .models import Photo, PressRelease, Chapter, OutgoingMessage
 
 
 @admin.register(PressRelease)
@@ -23,3 +23,11 @@ class PhotoAdmin(admin.ModelAdmin):
 @admin.register(Chapter)
 class ChapterAdmin(admin.ModelAdmin):
     list_display = ('title', 'site')
+
+
+@admin.register(OutgoingMessage)
+class OutgoingMessageAdmin(admin.ModelAdmin):
+    list_display = ('created', 'subject', 'recipients', 'sent', 'attempts', 'failed')
+    list_filter = ('failed', 'sent')
+    search_fields = ('subject', 'recipients')
+    readonly_fields = ('created', 'digest', 'sent', 'last_error')
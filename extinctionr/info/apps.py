@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class InfoConfig(AppConfig):
     name = 'extinctionr.info'
+
+    def ready(self):
+        import extinctionr.info.signals
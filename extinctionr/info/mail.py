@@ -0,0 +1,115 @@
+"""
+Outgoing mail queue.
+
+queue_mail() and queue_mass_mail() take the same arguments as django's send_mail()
+and send_mass_mail(), but only store the messages. The send_mail_queue command
+sends them in batches over one SMTP connection, retrying failures with a backoff.
+Each message is claimed before it's sent, so several workers can share the queue.
+"""
+from datetime import timedelta
+from hashlib import sha256
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.utils.timezone import now
+
+from .models import OutgoingMessage
+
+
+# identical messages queued within this window are only sent once
+DEDUP_WINDOW = timedelta(days=1)
+RETRY_DELAY = timedelta(minutes=2)
+# a claimed message is sent again if its worker hasn't recorded it by then
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_ATTEMPTS = 8
+BATCH_SIZE = 100
+
+
+def _digest(subject, message, from_email, recipients):
+    data = '\0'.join([subject, message, from_email] + recipients)
+    return sha256(data.encode('utf8')).hexdigest()
+
+
+def queue_mass_mail(datatuple):
+    """
+    Queues each (subject, message, from_email, recipient_list) in datatuple.
+    Returns the number of messages queued.
+    """
+    messages = {}
+    for subject, message, from_email, recipient_list in datatuple:
+        from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        recipients = sorted(set(r for r in recipient_list if r))
+        if not recipients:
+            continue
+        digest = _digest(subject, message, from_email, recipients)
+        messages[digest] = OutgoingMessage(
+            subject=subject,
+            body=message,
+            from_email=from_email,
+            recipients=','.join(recipients),
+            digest=digest)
+    if not messages:
+        return 0
+    recent = OutgoingMessage.objects.filter(digest__in=list(messages), created__gte=now() - DEDUP_WINDOW)
+    for digest in recent.values_list('digest', flat=True):
+        messages.pop(digest, None)
+    OutgoingMessage.objects.bulk_create(messages.values())
+    return len(messages)
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    return queue_mass_mail([(subject, message, from_email, recipient_list)])
+
+
+def send_queued(limit=BATCH_SIZE):
+    """
+    Sends up to `limit` due messages over a single connection.
+    Returns the number of messages (sent, failed).
+    """
+    queued = [msg for msg in OutgoingMessage.objects.due()[:limit] if _claim(msg)]
+    if not queued:
+        return 0, 0
+    sent = failed = 0
+    connection = get_connection()
+    try:
+        connection.open()
+        for msg in queued:
+            email = EmailMessage(msg.subject, msg.body, msg.from_email, msg.recipient_list, connection=connection)
+            try:
+                email.send()
+            except Exception as e:
+                _retry_later(msg, e)
+                failed += 1
+            else:
+                msg.attempts += 1
+                msg.sent = now()
+                msg.save(update_fields=['attempts', 'sent'])
+                sent += 1
+    except Exception as e:
+        # couldn't connect, try everything again later
+        for msg in queued[sent + failed:]:
+            _retry_later(msg, e)
+            failed += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _claim(msg):
+    """
+    Reserves `msg` for this worker, so that other workers running at the same time skip it
+    """
+    claimed_until = now() + CLAIM_TIMEOUT
+    claimed = OutgoingMessage.objects.filter(pk=msg.pk, sent=None, failed=False, next_attempt=msg.next_attempt).update(next_attempt=claimed_until)
+    msg.next_attempt = claimed_until
+    return claimed == 1
+
+
+def _retry_later(msg, error):
+    msg.attempts += 1
+    msg.last_error = str(error)
+    if msg.attempts >= MAX_ATTEMPTS:
+        msg.failed = True
+    else:
+        msg.next_attempt = now() + RETRY_DELAY * 2 ** (msg.attempts - 1)
+    msg.save(update_fields=['attempts', 'last_error', 'failed', 'next_attempt'])
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+
+from extinctionr import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Seeds a test database and measures query counts and latency of the public pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--volume', choices=sorted(benchmark.VOLUMES), default='full')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--record', action='store_true', help='save the results as the new budgets')
+
+    def handle(self, *args, **kwargs):
+        volume = kwargs['volume']
+        if kwargs['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        try:
+            with override_settings(CACHES=benchmark.LOCAL_CACHES):
+                self.stdout.write('seeding %s volume...' % volume)
+                user = benchmark.seed(**benchmark.VOLUMES[volume])
+                staff = Client()
+                staff.force_login(user)
+                results = benchmark.run(Client(), staff, repeat=kwargs['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, result in sorted(results.items()):
+            self.stdout.write('{:<20} {:>4} queries {:>8.3f}s  {}'.format(name, result['queries'], result['seconds'], result['url']))
+
+        if kwargs['record']:
+            benchmark.save_budgets(volume, results)
+            self.stdout.write('recorded budgets in %s' % benchmark.BUDGET_FILE)
+        else:
+            failures = benchmark.check(results, benchmark.load_budgets().get(volume, {}))
+            if failures:
+                raise CommandError('over budget:\n' + '\n'.join(failures))
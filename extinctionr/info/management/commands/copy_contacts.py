@@ -1,25 +1,19 @@
 from django.core.management.base import BaseCommand, CommandError
-import csv
-from extinctionr.utils import get_contact
-from contacts.models import Contact
+from extinctionr.circles.importer import ContactImporter, read_contacts
+
 
 class Command(BaseCommand):
+    help = 'Creates or updates contacts from a CSV file'
+
     def add_arguments(self, parser):
         parser.add_argument('filename', type=str)
 
     def handle(self, *args, **kwargs):
-        first = True
         with open(kwargs['filename'], 'r') as fp:
-            reader = csv.DictReader(fp)
-            for row in reader:
-                # if first:
-                #     first = False
-                #     continue
-                first_name = row['first_name']
-                last_name = row['last_name']
-                email = row['email']
-                zipcode = row['zip_code']
-                city = row['can2_user_city']
-                if email:
-                    c = get_contact(email, first_name=first_name, last_name=last_name, postcode=zipcode, city=city)
-                    self.stdout.write(str(c))
+            try:
+                importer = ContactImporter().run(read_contacts(fp))
+            except ValueError:
+                raise CommandError('The CSV file needs an email column')
+        for row, error in importer.errors:
+            self.stderr.write('Row %d: %s' % (row, error))
+        self.stdout.write('Read %d rows: %d new contacts, %d existing contacts' % (importer.rows, importer.created, importer.matched))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from extinctionr.actions.models import Action
+from extinctionr.circles.models import Circle, CircleJob, Couch
+from extinctionr.info.models import PressRelease
+from extinctionr.utils import render_markdown, rerender_markdown
+
+
+class Command(BaseCommand):
+    help = 'Renders the stored HTML of every markdown field again, e.g. after changing the markdown settings'
+
+    def handle(self, *args, **kwargs):
+        render_markdown.cache_clear()
+        for model in (Action, Circle, CircleJob, Couch, PressRelease):
+            num = rerender_markdown(model)
+            self.stdout.write('%s: rendered %d' % (model._meta.verbose_name_plural, num))
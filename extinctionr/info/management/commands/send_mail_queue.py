@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+from extinctionr.info.mail import send_queued
+
+
+class Command(BaseCommand):
+    help = 'Sends queued outgoing mail. Use --loop to keep running as a worker.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='keep checking for new mail')
+        parser.add_argument('--interval', type=int, default=10, help='seconds to wait when the queue is empty')
+
+    def handle(self, *args, **kwargs):
+        while True:
+            sent, failed = send_queued()
+            if sent or failed:
+                self.stdout.write('sent %d, failed %d' % (sent, failed))
+            if not kwargs['loop']:
+                break
+            if not (sent or failed):
+                time.sleep(kwargs['interval'])
@@ -0,0 +1,41 @@
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.utils.timezone import now
+from extinctionr.actions.models import Action
+from extinctionr.circles.models import Circle
+from extinctionr.utils import RENDER_GENERATIONS, base_url, bump_generation
+
+
+# pages every visitor is likely to see
+HOT_PAGES = ('/', '/action/', '/action/ical/all', '/circle/', '/pr/')
+
+
+class Command(BaseCommand):
+    help = 'Renders the busiest public pages into the shared cache, e.g. after a deploy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='', help='scheme and host the site is visited on, defaults to the current Site')
+        parser.add_argument('--actions', type=int, default=20, help='number of upcoming actions to render')
+
+    def handle(self, *args, **kwargs):
+        # retire what the previous version rendered
+        for name in RENDER_GENERATIONS:
+            bump_generation(name)
+
+        # pages are cached by their absolute URL, so render them for the host people visit
+        url = urlsplit(kwargs['base_url'] or base_url())
+        client = Client(HTTP_HOST=url.netloc)
+        secure = url.scheme == 'https'
+
+        pages = list(HOT_PAGES)
+        upcoming = Action.objects.for_visibility('anonymous').filter(when__gte=now())[:kwargs['actions']]
+        pages.extend(action.get_absolute_url() for action in upcoming)
+        pages.extend(circle.get_absolute_url() for circle in Circle.objects.filter(parent__isnull=True))
+
+        for page in pages:
+            response = client.get(page, secure=secure)
+            if response.streaming:
+                b''.join(response.streaming_content)
+            self.stdout.write('{} {}'.format(response.status_code, page))
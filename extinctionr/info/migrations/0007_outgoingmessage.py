@@ -0,0 +1,29 @@
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('info', '0006_chapter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutgoingMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('subject', models.TextField()),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=255)),
+                ('recipients', models.TextField(help_text='Comma-separated email addresses')),
+                ('digest', models.CharField(db_index=True, help_text='Hash of the message, to avoid sending duplicates', max_length=64)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('sent', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('failed', models.BooleanField(default=False, help_text='Gave up after too many attempts')),
+                ('last_error', models.TextField(blank=True, default='')),
+            ],
+        ),
+    ]
@@ -4,6 +4,7 @@ from django.urls import reverse
 from django.utils.safestring import mark_safe
 from django.utils.timezone import now
 from markdownx.models import MarkdownxField
+from extinctionr.utils import RenderedMarkdownMixin
 
 
 class PressReleaseManager(models.Manager):
@@ -11,16 +12,19 @@ class PressReleaseManager(models.Manager):
         return self.get_queryset().filter(released__lt=now()).order_by('-released')
 
 
-class PressRelease(models.Model):
+class PressRelease(RenderedMarkdownMixin, models.Model):
     title = models.CharField(max_length=255, db_index=True)
     slug = models.SlugField(unique=True)
     created = models.DateTimeField(db_index=True, auto_now_add=True)
     released = models.DateTimeField(db_index=True, null=True, blank=True, help_text='Release dates in the future will not be visible on the site')
     body = MarkdownxField(default='', blank=True)
+    body_html = models.TextField(default='', blank=True, editable=False)
     modified = models.DateTimeField(auto_now=True)
 
     objects = PressReleaseManager()
 
+    markdown_fields = ('body', )
+
     @property
     def is_released(self):
         return self.released and self.released <= now()
@@ -62,3 +66,32 @@ class Chapter(models.Model):
     def __str__(self):
         return self.title
 
+
+
+class OutgoingMessageManager(models.Manager):
+    def due(self):
+        return self.get_queryset().filter(sent__isnull=True, failed=False, next_attempt__lte=now()).order_by('next_attempt', 'id')
+
+
+# Mail waiting to be sent by the send_mail_queue command
+class OutgoingMessage(models.Model):
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+    subject = models.TextField()
+    body = models.TextField()
+    from_email = models.CharField(max_length=255)
+    recipients = models.TextField(help_text='Comma-separated email addresses')
+    digest = models.CharField(max_length=64, db_index=True, help_text='Hash of the message, to avoid sending duplicates')
+    attempts = models.IntegerField(default=0)
+    next_attempt = models.DateTimeField(default=now, db_index=True)
+    sent = models.DateTimeField(null=True, blank=True, db_index=True)
+    failed = models.BooleanField(default=False, help_text='Gave up after too many attempts')
+    last_error = models.TextField(default='', blank=True)
+
+    objects = OutgoingMessageManager()
+
+    def __str__(self):
+        return '{} to {}'.format(self.subject, self.recipients)
+
+    @property
+    def recipient_list(self):
+        return [r for r in self.recipients.split(',') if r]
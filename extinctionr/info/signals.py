@@ -0,0 +1,11 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from extinctionr.utils import bump_generation
+
+from .models import PressRelease
+
+
+@receiver(post_save, sender=PressRelease)
+@receiver(post_delete, sender=PressRelease)
+def invalidate_press_releases(sender, instance, **kwargs):
+    bump_generation('press')
@@ -1,10 +1,9 @@
 from django import template
-from django.utils.html import strip_tags
 from django.utils.safestring import mark_safe
-from markdownx.utils import markdownify
+from extinctionr.utils import render_markdown
 
 register = template.Library()
 
 @register.filter('markdownify')
 def _markdownify(content):
-	return mark_safe(markdownify(strip_tags(content)))
+	return mark_safe(render_markdown(str(content)))
@@ -11,8 +11,8 @@ from django.template.loader import TemplateDoesNotExist, get_template
 from django.utils.decorators import method_decorator
 from django.utils.http import http_date
 from django.views.decorators.http import etag
-from django.views.decorators.cache import cache_page
 from django.views.generic import FormView, DetailView, ListView, TemplateView
+from extinctionr.utils import page_cache
 
 from .models import PressRelease, Chapter
 
@@ -53,18 +53,18 @@ class ContactView(FormView):
 
     def form_valid(self, form):
         from django.conf import settings
-        from django.core.mail import send_mail
         from extinctionr.circles import get_circle
+        from .mail import queue_mail
         outreach_circle = get_circle('outreach')
         address = self.request.META.get('HTTP_X_FORWARDED_FOR', self.request.META.get('REMOTE_ADDR', 'unknown address'))
         subject = '[XR] Website Contact from {}'.format(address)
         message = form.cleaned_data['message']
-        send_mail(subject, message, settings.DEFAULT_FROM_EMAIL, outreach_circle.get_notification_addresses())
+        queue_mail(subject, message, settings.DEFAULT_FROM_EMAIL, outreach_circle.get_notification_addresses())
         messages.success(self.request, "Thanks for your feedback")
         return super().form_valid(form)
 
 
-@method_decorator(cache_page(1200), name='dispatch')
+@method_decorator(page_cache('actions', 'press'), name='dispatch')
 class InfoView(TemplateView):
     def get(self, request, *args, **kwargs):
         page = kwargs['page']
@@ -86,7 +86,7 @@ class InfoView(TemplateView):
         return response
 
 
-@method_decorator(cache_page(1200), name='dispatch')
+@method_decorator(page_cache('press'), name='dispatch')
 class PRListView(ListView):
     def get_queryset(self):
         if self.request.user.has_perm('info.view_pressrelease'):
@@ -102,7 +102,7 @@ class PRListView(ListView):
             resp['Cache-Control'] = 'private'
         return resp
 
-@method_decorator(cache_page(1200), name='dispatch')
+@method_decorator(page_cache('press'), name='dispatch')
 class PRDetailView(DetailView):
     def get_queryset(self):
         if self.request.user.has_perm('info.view_pressrelease'):
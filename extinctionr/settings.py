@@ -64,7 +64,7 @@ INSTALLED_APPS = [
     'marketing',
     # end of CRM stuff
     'extinctionr.actions.apps.ActionsConfig',
-    'extinctionr.info',
+    'extinctionr.info.apps.InfoConfig',
     'extinctionr.circles.apps.CircleConfig',
     # django wiki
     'django_nyt.apps.DjangoNytConfig',
@@ -259,6 +259,35 @@ PHONENUMBER_DEFAULT_REGION = 'US'
 
 CACHE_MIDDLEWARE_SECONDS = 1200
 
+# The cache is shared by all of the worker processes and kept across restarts.
+# By default it's kept in files, set CACHE_URL to memcached://host:port
+# or redis://host:port/db (which needs the django-redis package) to use a cache server.
+CACHE_URL = os.getenv('CACHE_URL', '')
+if CACHE_URL.startswith('memcached://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': CACHE_URL[len('memcached://'):],
+        }
+    }
+elif CACHE_URL.startswith('redis://'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', os.path.join(BASE_DIR, 'extinctionr', 'var', 'cache')),
+            'OPTIONS': {
+                'MAX_ENTRIES': 20000,
+            },
+        }
+    }
+
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_SCHEME', 'https')
 SESSION_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
 
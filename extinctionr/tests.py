@@ -0,0 +1,188 @@
+from contacts.models import Contact
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.utils.timezone import now
+
+from . import benchmark
+from .circles.models import Circle, CircleMember, ContactSearchTerm, Couch
+from .info.mail import _claim, queue_mail
+from .info.models import OutgoingMessage, PressRelease
+from .utils import contact_cache, get_contacts, get_generation, lookup_contact, markdown_cache_key, render_markdown
+
+
+@override_settings(CACHES=benchmark.LOCAL_CACHES)
+class CacheTestCase(TestCase):
+    """
+    Gives the tests, which clear the cache, their own instead of the site's
+    """
+
+
+class QueryBudgetTest(CacheTestCase):
+    """
+    Fails when a public page runs more queries than recorded in benchmarks.json.
+    Record new budgets with: ./manage.py benchmark --volume small --record
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = benchmark.seed(**benchmark.VOLUMES['small'])
+
+    def test_query_budgets(self):
+        budgets = benchmark.load_budgets().get('small', {})
+        if not budgets:
+            self.skipTest('no budgets recorded, run: ./manage.py benchmark --volume small --record')
+        staff = Client()
+        staff.force_login(self.user)
+        results = benchmark.run(Client(), staff, repeat=0)
+        for name, result in results.items():
+            with self.subTest(page=name):
+                self.assertEqual(result['status'], 200)
+                self.assertIn(name, budgets, 'no query budget recorded')
+                self.assertLessEqual(result['queries'], budgets[name]['queries'])
+
+
+class LookupContactTest(CacheTestCase):
+    def setUp(self):
+        contact_cache.clear()
+
+    def test_cached_until_saved(self):
+        contact = Contact.objects.create(email='someone@example.com', first_name='Some', last_name='One')
+        self.assertIsNone(lookup_contact('nobody@example.com'))
+        self.assertEqual(lookup_contact(' Someone@Example.com').pk, contact.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(lookup_contact('someone@example.com').first_name, 'Some')
+        contact.first_name = 'Any'
+        contact.save()
+        self.assertEqual(lookup_contact('someone@example.com').first_name, 'Any')
+
+
+class GetContactsTest(CacheTestCase):
+    def test_creates_and_renames(self):
+        Contact.objects.create(email='old@example.com', first_name='Old', last_name='?')
+        contacts = get_contacts([
+            {'email': ' Old@Example.com', 'name': 'Old Timer'},
+            {'email': 'new@example.com', 'first_name': 'New', 'last_name': 'Comer'},
+        ])
+        self.assertEqual(set(contacts), {'old@example.com', 'new@example.com'})
+        for email, contact in contacts.items():
+            self.assertEqual(Contact.objects.get(email=email).pk, contact.pk)
+        self.assertEqual(contacts['old@example.com'].last_name, 'Timer')
+        self.assertEqual(ContactSearchTerm.objects.search('comer'), [contacts['new@example.com'].pk])
+
+
+class ContactSearchTest(CacheTestCase):
+    def test_prefix_search(self):
+        contact = Contact.objects.create(email='jane@example.com', first_name='Jane', last_name='Doe')
+        Contact.objects.create(email='john@example.com', first_name='John', last_name='Smith')
+        self.assertEqual(len(ContactSearchTerm.objects.search('j')), 2)
+        self.assertEqual(ContactSearchTerm.objects.search(' DO'), [contact.pk])
+        self.assertEqual(ContactSearchTerm.objects.search('jane  d'), [contact.pk])
+        self.assertEqual(ContactSearchTerm.objects.search('x'), [])
+        with self.assertNumQueries(0):
+            self.assertEqual(ContactSearchTerm.objects.search('do'), [contact.pk])
+        contact.last_name = 'Roe'
+        contact.save()
+        self.assertEqual(ContactSearchTerm.objects.search('do'), [])
+        self.assertEqual(ContactSearchTerm.objects.search('ro'), [contact.pk])
+
+
+class RenderMarkdownTest(CacheTestCase):
+    def test_render_markdown(self):
+        cache.clear()
+        render_markdown.cache_clear()
+        html = render_markdown('**bold** <script>alert(1)</script>')
+        self.assertIn('<strong>bold</strong>', html)
+        self.assertNotIn('<script>', html)
+        # a fresh process finds it in the shared cache
+        render_markdown.cache_clear()
+        cache.set(markdown_cache_key('cached'), '<p>from the cache</p>')
+        self.assertEqual(render_markdown('cached'), '<p>from the cache</p>')
+        # HTML rendered with other markdown settings isn't used
+        key = markdown_cache_key('cached')
+        with self.settings(MARKDOWNX_MARKDOWN_EXTENSIONS=['markdown.extensions.extra']):
+            self.assertNotEqual(markdown_cache_key('cached'), key)
+
+
+class PageCacheTest(CacheTestCase):
+    def test_cached_until_changed(self):
+        cache.clear()
+        release = PressRelease.objects.create(title='First release', slug='first', released=now())
+        client = Client()
+        self.assertContains(client.get('/pr/first'), 'First release')
+        # update() skips the signals, so the cached page is still served
+        PressRelease.objects.filter(pk=release.pk).update(title='Quietly renamed')
+        self.assertContains(client.get('/pr/first'), 'First release')
+        release.refresh_from_db()
+        release.title = 'Renamed'
+        release.save()
+        self.assertContains(client.get('/pr/first'), 'Renamed')
+
+    def test_logged_in_users_bypass_the_cache(self):
+        cache.clear()
+        release = PressRelease.objects.create(title='First release', slug='first', released=now())
+        Client().get('/pr/first')
+        PressRelease.objects.filter(pk=release.pk).update(title='Quietly renamed')
+        client = Client()
+        client.force_login(get_user_model().objects.create(username='someone'))
+        self.assertContains(client.get('/pr/first'), 'Quietly renamed')
+
+    def test_couches_follow_their_owners(self):
+        cache.clear()
+        owner = Contact.objects.create(email='host@example.com', first_name='Host', last_name='One')
+        client = Client()
+        self.assertNotContains(client.get('/circle/couches/'), 'host@example.com')
+        couch = Couch.objects.create(owner=owner, info='A spare room', public=True)
+        self.assertContains(client.get('/circle/couches/'), 'host@example.com')
+        owner.email = 'host@example.org'
+        owner.save()
+        self.assertContains(client.get('/circle/couches/'), 'host@example.org')
+        couch.delete()
+        self.assertNotContains(client.get('/circle/couches/'), 'host@example.org')
+        # contacts that aren't on the circle pages leave them cached
+        generation = get_generation('circles')
+        Contact.objects.create(email='signup@example.com', first_name='New', last_name='Signup')
+        self.assertEqual(get_generation('circles'), generation)
+
+
+class MailQueueTest(CacheTestCase):
+    def test_claimed_once(self):
+        queue_mail('Subject', 'Body', 'from@example.com', ['to@example.com'])
+        first = OutgoingMessage.objects.due().get()
+        second = OutgoingMessage.objects.get(pk=first.pk)
+        self.assertTrue(_claim(first))
+        # another worker that read the row at the same time doesn't get it
+        self.assertFalse(_claim(second))
+        self.assertFalse(OutgoingMessage.objects.due().exists())
+
+
+class MemberCountTest(CacheTestCase):
+    def test_counts_match_rebuild(self):
+        parent = Circle.objects.create(name='Parent', purpose='')
+        child = Circle.objects.create(name='Child', purpose='', parent=parent)
+        contact = Contact.objects.create(email='someone@example.com', first_name='Some', last_name='One')
+        CircleMember.objects.create(circle=child, contact=contact, role='member')
+        # already counted in the parent's subtree, but not as a member of the parent itself
+        joined = CircleMember.objects.create(circle=parent, contact=contact, role='member')
+        parent.refresh_from_db()
+        self.assertEqual((parent.member_count, parent.recursive_member_count), (1, 1))
+        self.assertEqual(Circle.objects.rebuild_member_counts(), 0)
+        joined.delete()
+        parent.refresh_from_db()
+        self.assertEqual((parent.member_count, parent.recursive_member_count), (0, 1))
+        self.assertEqual(Circle.objects.rebuild_member_counts(), 0)
+
+    def test_moved_and_promoted_members(self):
+        first = Circle.objects.create(name='First', purpose='')
+        second = Circle.objects.create(name='Second', purpose='')
+        contact = Contact.objects.create(email='someone@example.com', first_name='Some', last_name='One')
+        member = CircleMember.objects.create(circle=first, contact=contact, role='member')
+        member.circle = second
+        member.save()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual((first.member_count, second.member_count), (0, 1))
+        member.role = 'lead'
+        member.save()
+        second.refresh_from_db()
+        self.assertTrue(second.has_leads)
+        self.assertEqual(Circle.objects.rebuild_member_counts(), 0)
@@ -1,15 +1,62 @@
+import csv
+import threading
+import time
+
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from hashlib import md5
+
 from contacts.models import Contact, Address
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.sites.models import Site
+from django.core.cache import cache
+from django.db import transaction
+from django.http import StreamingHttpResponse
+from django.views.decorators.http import condition
+from django.utils.html import strip_tags
+from markdownx.utils import markdownify
+from taggit.models import Tag, TaggedItem
+
+
+# keeps IN (...) lists under sqlite's variable limit
+BATCH_SIZE = 500
+
+MARKDOWN_CACHE_SIZE = 512
+MARKDOWN_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+# the settings that change what markdownify outputs
+MARKDOWN_SETTINGS = ('MARKDOWNX_MARKDOWNIFY_FUNCTION', 'MARKDOWNX_MARKDOWN_EXTENSIONS', 'MARKDOWNX_MARKDOWN_EXTENSION_CONFIGS')
+
+CONTACT_CACHE_SIZE = 1024
+# other processes don't see our invalidations, so don't trust an entry for long
+CONTACT_CACHE_TIMEOUT = 60
+
+
+def split_name(name):
+    sname = name.split(' ', 1)
+    if len(sname) == 2:
+        return sname
+    else:
+        return sname[0], '?'
+
+
+@lru_cache(maxsize=None)
+def address_fields():
+    return tuple(f.name for f in Address._meta.fields if f.name != 'id')
+
+
+@lru_cache(maxsize=None)
+def contact_fields():
+    # the primary key comes first, see ContactCache.discard()
+    pk = Contact._meta.pk.attname
+    return (pk, ) + tuple(f.attname for f in Contact._meta.concrete_fields if f.attname != pk)
 
 
 def get_contact(email, name='', first_name='', last_name='', **kwargs):
     email = email.lower().strip()
     assert email
-    addr_keys = [f.name for f in Address._meta.fields]
-    addr_keys.remove('id')
     address = {}
-    for k in addr_keys:
+    for k in address_fields():
         if k in kwargs:
             address[k] = kwargs.pop(k)
 
@@ -17,12 +64,7 @@ def get_contact(email, name='', first_name='', last_name='', **kwargs):
         user = Contact.objects.get(email=email)
     except Contact.DoesNotExist:
         if not (first_name and last_name):
-            sname = name.split(' ', 1)
-            if len(sname) == 2:
-                first_name, last_name = sname
-            else:
-                first_name = sname[0]
-                last_name = '?'
+            first_name, last_name = split_name(name)
         user = Contact.objects.create(email=email, first_name=first_name, last_name=last_name, **kwargs)
     resave = False
     for k, v in kwargs.items():
@@ -50,6 +92,229 @@ def get_contact(email, name='', first_name='', last_name='', **kwargs):
     return user
 
 
+class ContactCache:
+    """
+    Thread-safe LRU of email -> contact field values, emptied of a contact when it's saved or deleted (see circles.signals)
+    """
+    def __init__(self, size=CONTACT_CACHE_SIZE, timeout=CONTACT_CACHE_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, email):
+        with self.lock:
+            entry = self.entries.get(email)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[email]
+                return None
+            self.entries.move_to_end(email)
+            return entry[1]
+
+    def set(self, email, values):
+        with self.lock:
+            self.entries[email] = (time.monotonic() + self.timeout, values)
+            self.entries.move_to_end(email)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def discard(self, contact):
+        with self.lock:
+            for email, (expires, values) in list(self.entries.items()):
+                if email == contact.email or values[0] == contact.pk:
+                    del self.entries[email]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+contact_cache = ContactCache()
+
+
+def lookup_contact(email):
+    """
+    Read-only version of get_contact: returns the Contact for `email`, or None.
+    Never creates or saves anything.
+    """
+    email = (email or '').lower().strip()
+    if not email:
+        return None
+    fields = contact_fields()
+    values = contact_cache.get(email)
+    if values is None:
+        values = Contact.objects.filter(email=email).values_list(*fields).first()
+        if values is None:
+            return None
+        contact_cache.set(email, values)
+    # the cache holds field values, so every caller gets its own instance
+    return Contact.from_db('default', fields, values)
+
+
+def user_contact(user, create=False):
+    """
+    Returns the Contact of a logged in user, resolved once and kept on the user for the rest of the request.
+    With create=True, a missing contact is created with get_contact.
+    """
+    if not (user.is_authenticated and user.email):
+        return None
+    contact = getattr(user, '_contact', None)
+    if contact is None:
+        contact = lookup_contact(user.email)
+        if contact is None and create:
+            contact = get_contact(user.email, first_name=user.first_name, last_name=user.last_name)
+        user._contact = contact
+    return contact
+
+
+def batches(items, size=BATCH_SIZE):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def iter_chunks(qset, chunk_size=BATCH_SIZE):
+    """
+    Yields the objects of `qset` in order, loading `chunk_size` of them at a time.
+    Unlike iterator(), select_related and prefetch_related lookups still apply, once per chunk.
+    """
+    pks = list(qset.prefetch_related(None).values_list('pk', flat=True))
+    for chunk in batches(pks, chunk_size):
+        objs = {obj.pk: obj for obj in qset.filter(pk__in=chunk).order_by()}
+        for pk in chunk:
+            if pk in objs:
+                yield objs[pk]
+
+
+class Echo:
+    """
+    A file-like object that returns what's written, so csv.writer can produce lines one at a time
+    """
+    def write(self, value):
+        return value
+
+
+def stream_csv(rows, filename=None, header=None):
+    """
+    Returns a StreamingHttpResponse with `rows` written as CSV lines, as they are generated
+    """
+    writer = csv.writer(Echo())
+
+    def lines():
+        if header:
+            yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    if filename:
+        response['Content-Disposition'] = 'attachment; filename="%s"' % filename
+    return response
+
+
+def upsert_contacts(people, fill, update_fields=('first_name', 'last_name'), before_save=None, select_related=()):
+    """
+    Finds or creates the contact of every email in `people`, a dict of email -> person dict.
+    fill(contact, person) fills in a found or new contact and returns whether it changed a found one.
+    before_save(new, changed), if given, is called before anything is written.
+    Changed contacts are saved with bulk_update, new ones with bulk_create, after which they're
+    selected again by their (unique) email, since not every database returns the new primary keys.
+    Returns (dict of email -> Contact, number of contacts created)
+    """
+    contacts = {}
+    for emails in batches(people):
+        contacts.update((c.email, c) for c in Contact.objects.filter(email__in=emails).select_related(*select_related))
+    new = []
+    changed = []
+    for email, person in people.items():
+        contact = contacts.get(email)
+        if contact is None:
+            contact = Contact(email=email)
+            fill(contact, person)
+            new.append(contact)
+        elif fill(contact, person):
+            changed.append(contact)
+    with transaction.atomic():
+        if before_save:
+            before_save(new, changed)
+        if changed:
+            Contact.objects.bulk_update(changed, update_fields, batch_size=BATCH_SIZE)
+        if new:
+            Contact.objects.bulk_create(new, batch_size=BATCH_SIZE)
+            for emails in batches(c.email for c in new):
+                contacts.update((c.email, c) for c in Contact.objects.filter(email__in=emails).select_related(*select_related))
+        if changed or new:
+            # bulk_create and bulk_update don't send post_save, so do what the receivers would
+            for contact in changed:
+                contact_cache.discard(contact)
+            from extinctionr.circles.models import ContactSearchTerm, shown_on_circle_pages
+            if changed and shown_on_circle_pages([c.pk for c in changed]):
+                bump_generation('circles')
+            ContactSearchTerm.objects.index(changed + [contacts[c.email] for c in new])
+    return contacts, len(new)
+
+
+def get_contacts(people):
+    """
+    Batch version of get_contact, for imports.
+    `people` is an iterable of dicts with an 'email' and either a 'name' or 'first_name' and 'last_name'.
+    Returns a dict of email -> Contact, creating the missing contacts with bulk_create
+    """
+    people = {p['email'].lower().strip(): p for p in people if p.get('email', '').strip()}
+
+    def fill(contact, person):
+        first_name = person.get('first_name', '')
+        last_name = person.get('last_name', '')
+        if not (first_name and last_name):
+            first_name, last_name = split_name(person.get('name', ''))
+        if contact.pk is None:
+            contact.first_name, contact.last_name = first_name, last_name
+        elif last_name != '?' and contact.last_name in ('', '?', 'unknown'):
+            contact.first_name = contact.first_name or first_name
+            contact.last_name = last_name
+            return True
+        return False
+
+    return upsert_contacts(people, fill)[0]
+
+
+def bulk_create_with_pks(model, objs):
+    """
+    bulk_create that also sets the primary keys. Where the database can't return them
+    from a bulk insert (sqlite before django 4), the objects are inserted one at a time.
+    """
+    features = transaction.get_connection().features
+    if getattr(features, 'can_return_rows_from_bulk_insert', getattr(features, 'can_return_ids_from_bulk_insert', False)):
+        model.objects.bulk_create(objs, batch_size=BATCH_SIZE)
+    else:
+        with transaction.atomic():
+            for obj in objs:
+                obj.save(force_insert=True)
+    return objs
+
+
+def tag_contacts(contact_ids, tags):
+    """
+    Adds `tags` (names or Tag objects) to all of the contacts in one pass
+    """
+    tag_objs = [t for t in tags if isinstance(t, Tag)]
+    for name in set(t for t in tags if not isinstance(t, Tag)):
+        tag_objs.append(Tag.objects.get_or_create(name=name)[0])
+    if not tag_objs:
+        return
+    content_type = ContentType.objects.get_for_model(Contact)
+    items = [
+        TaggedItem(content_type=content_type, object_id=contact_id, tag=tag)
+        for contact_id in set(contact_ids) for tag in tag_objs]
+    TaggedItem.objects.bulk_create(items, batch_size=BATCH_SIZE, ignore_conflicts=True)
+    # bulk_create doesn't send post_save, so index the tags for the people finder here
+    from extinctionr.circles.models import ContactFacet
+    for tag in tag_objs:
+        ContactFacet.objects.add(ContactFacet.TAG, tag.id, contact_ids)
+
+
 def get_last_contact(request):
     last = request.session.get('last-contact', None)
     if last:
@@ -66,3 +331,184 @@ def base_url():
     current_site = Site.objects.get_current()
     scheme = 'http' if settings.DEBUG else 'https'
     return '%s://%s' % (scheme, current_site.domain)
+
+
+def _first_generation():
+    # a counter evicted from the cache starts again above any number it reached before,
+    # so pages cached under an old generation are never served again
+    return int(time.time() * 1000000)
+
+
+def get_generation(name):
+    """
+    Returns the current generation number for `name`.
+    Cache keys that embed the generation are invalidated by bump_generation()
+    """
+    key = 'generation:%s' % name
+    cache.add(key, _first_generation(), None)
+    return cache.get(key, 1)
+
+
+def bump_generation(name):
+    key = 'generation:%s' % name
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, _first_generation(), None)
+
+
+# every generation that rendered pages and feeds are cached on. warm_cache bumps them all
+# after a deploy, since the new code and templates may render the same data differently
+RENDER_GENERATIONS = ('actions', 'attendees', 'circles', 'feed', 'press')
+
+
+def markdown_cache_key(content):
+    """
+    The shared cache key of `content`'s HTML, which includes the markdown settings
+    so that changing them doesn't bring back HTML rendered with the old ones
+    """
+    version = md5(repr([getattr(settings, name, None) for name in MARKDOWN_SETTINGS]).encode('utf8')).hexdigest()[:8]
+    return 'markdown:%s:%s' % (version, md5(content.encode('utf8')).hexdigest())
+
+
+def _render_markdown(content):
+    html = markdownify(strip_tags(content))
+    cache.set(markdown_cache_key(content), html, MARKDOWN_CACHE_TIMEOUT)
+    return html
+
+
+@lru_cache(maxsize=MARKDOWN_CACHE_SIZE)
+def render_markdown(content):
+    """
+    Returns the HTML for markdown `content`, after stripping any HTML from it.
+    The output only depends on the content and the settings, so it's kept in-process and in the shared cache.
+    """
+    html = cache.get(markdown_cache_key(content))
+    if html is None:
+        html = _render_markdown(content)
+    return html
+
+
+class RenderedMarkdownMixin:
+    """
+    Keeps the rendered HTML of each of the model's `markdown_fields` in a `<field>_html` column,
+    so that pages only have to output it
+    """
+    markdown_fields = ()
+
+    def render_markdown_fields(self, render=render_markdown):
+        """
+        Renders the HTML columns, and returns the names of the ones that changed
+        """
+        changed = []
+        for name in self.markdown_fields:
+            html = render(str(getattr(self, name)))
+            if getattr(self, name + '_html') != html:
+                setattr(self, name + '_html', html)
+                changed.append(name + '_html')
+        return changed
+
+    def save(self, *args, **kwargs):
+        self.render_markdown_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = set(update_fields) | {name + '_html' for name in self.markdown_fields if name in update_fields}
+        return super().save(*args, **kwargs)
+
+
+def rerender_markdown(model):
+    """
+    Renders the HTML columns of every `model` object again, without touching anything else.
+    Skips the caches, which may hold HTML from an older version of the markdown library.
+    Returns the number of objects that changed.
+    """
+    html_fields = [name + '_html' for name in model.markdown_fields]
+    changed = []
+    for obj in model.objects.only('pk', *(list(model.markdown_fields) + html_fields)).iterator():
+        if obj.render_markdown_fields(render=_render_markdown):
+            changed.append(obj)
+    model.objects.bulk_update(changed, html_fields, batch_size=BATCH_SIZE)
+    return len(changed)
+
+
+# the cookie django.contrib.messages keeps pending messages in
+MESSAGES_COOKIE = 'messages'
+
+
+def _can_use_page_cache(request):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if settings.SESSION_COOKIE_NAME in request.COOKIES or MESSAGES_COOKIE in request.COOKIES:
+        # the page may show the last contact, or a message
+        return False
+    return not request.user.is_authenticated
+
+
+def _can_store_page(request, response):
+    if response.status_code != 200 or response.streaming or response.cookies:
+        return False
+    if 'private' in response.get('Cache-Control', '') or 'no-cache' in response.get('Cache-Control', ''):
+        return False
+    session = getattr(request, 'session', None)
+    if session is not None and session.modified:
+        return False
+    messages = getattr(request, '_messages', None)
+    return not (messages is not None and getattr(messages, 'added_new', False))
+
+
+def page_cache(*generations, timeout=None):
+    """
+    Caches the responses the decorated view gives anonymous visitors, keyed on the URL and the current
+    number of each of `generations`. Bumping one of them with bump_generation() shows the changes at once.
+    Logged in users, and visitors with a session or messages, always get a fresh page.
+    """
+    if timeout is None:
+        timeout = settings.CACHE_MIDDLEWARE_SECONDS
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not _can_use_page_cache(request):
+                return view(request, *args, **kwargs)
+            key = 'page:%s:%s' % (
+                ':'.join(str(get_generation(name)) for name in generations),
+                md5(request.build_absolute_uri().encode('utf8')).hexdigest())
+            response = cache.get(key)
+            if response is not None:
+                return response
+            response = view(request, *args, **kwargs)
+            if request.method == 'GET':
+                def store(response):
+                    if _can_store_page(request, response):
+                        cache.set(key, response, timeout)
+                if hasattr(response, 'render') and callable(response.render):
+                    response.add_post_render_callback(store)
+                else:
+                    store(response)
+            return response
+        return wrapper
+    return decorator
+
+
+def page_condition(get_state, *generations):
+    """
+    Like django's condition() decorator, with the ETag and Last-Modified computed together, once per request.
+    get_state(request, *args, **kwargs) returns (last modified datetime, values the page depends on),
+    or None to skip the check. A last modified of None sends only the ETag. The ETag also covers `generations`, the user and the last contact
+    in the session, since those change the page too.
+    """
+    def validators(request, *args, **kwargs):
+        if not hasattr(request, '_page_validators'):
+            request._page_validators = (None, None)
+            if MESSAGES_COOKIE not in request.COOKIES:
+                state = get_state(request, *args, **kwargs)
+                if state is not None:
+                    last_modified, values = state
+                    who = (request.user.pk if request.user.is_authenticated else 0, request.session.get('last-contact'))
+                    tag = ':'.join(str(v) for v in who + tuple(get_generation(name) for name in generations) + tuple(values))
+                    request._page_validators = (md5(tag.encode('utf8')).hexdigest(), last_modified)
+        return request._page_validators
+
+    return condition(
+        etag_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs)[0],
+        last_modified_func=lambda request, *args, **kwargs: validators(request, *args, **kwargs)[1])
@@ -9,4 +9,5 @@ export DJANGO_SETTINGS_MODULE=extinctionr.prod_settings
 
 python manage.py migrate --settings=extinctionr.prod_settings
 python manage.py collectstatic --settings=extinctionr.prod_settings --noinput
+python manage.py warm_cache --settings=extinctionr.prod_settings
 exec gunicorn --threads 4 --max-requests 1000 --keep-alive 3600 extinctionr.wsgi